@@ -490,7 +490,7 @@ class State(object):
                    json_dict.get('attributes'), last_changed)
 
     def __eq__(self, other):
-        return (self.__class__ == other.__class__ and
+        return (isinstance(other, State) and
                 self.entity_id == other.entity_id and
                 self.state == other.state and
                 self.attributes == other.attributes)
@@ -512,6 +512,10 @@ class StateMachine(object):
         self._bus = bus
         self._lock = threading.Lock()
 
+        # Increases with every change so callers can cheaply tell if
+        # anything changed since they last looked
+        self.version = 0
+
     def entity_ids(self, domain_filter=None):
         """ List of entity ids that are being tracked. """
         if domain_filter is not None:
@@ -558,7 +562,12 @@ class StateMachine(object):
         entity_id = entity_id.lower()
 
         with self._lock:
-            return self._states.pop(entity_id, None) is not None
+            if self._states.pop(entity_id, None) is None:
+                return False
+
+            self.version += 1
+
+            return True
 
     def set(self, entity_id, new_state, attributes=None):
         """ Set the state of an entity, add entity if it does not exist.
@@ -585,6 +594,7 @@ class StateMachine(object):
 
                 state = State(entity_id, new_state, attributes, last_changed)
                 self._states[entity_id] = state
+                self.version += 1
 
                 event_data = {'entity_id': entity_id, 'new_state': state}
 
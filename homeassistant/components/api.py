@@ -8,6 +8,7 @@ import re
 import logging
 import threading
 import json
+import queue
 
 import homeassistant as ha
 from homeassistant.helpers import TrackStates
@@ -25,6 +26,11 @@ DEPENDENCIES = ['http']
 
 STREAM_PING_PAYLOAD = "ping"
 STREAM_PING_INTERVAL = 50  # seconds
+# Messages a stream client can fall behind before it gets disconnected
+STREAM_QUEUE_SIZE = 100
+
+CLOSE_REASON_STOP = 'stop'
+CLOSE_REASON_SLOW = 'slow'
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -40,7 +46,8 @@ def setup(hass, config):
     hass.http.register_path('GET', URL_API, _handle_get_api)
 
     # /api/stream
-    hass.http.register_path('GET', URL_API_STREAM, _handle_get_api_stream)
+    hass.http.register_path(
+        'GET', URL_API_STREAM, StreamBroadcaster(hass).handle_stream)
 
     # /states
     hass.http.register_path('GET', URL_API_STATES, _handle_get_api_states)
@@ -87,69 +94,128 @@ def _handle_get_api(handler, path_match, data):
     handler.write_json_message("API running.")
 
 
-def _handle_get_api_stream(handler, path_match, data):
-    """ Provide a streaming interface for the event bus. """
-    gracefully_closed = False
-    hass = handler.server.hass
-    wfile = handler.wfile
-    write_lock = threading.Lock()
-    block = threading.Event()
+class StreamClient(object):
+    """ A client of the event stream. """
+    # pylint: disable=too-few-public-methods
 
-    def write_message(payload):
-        """ Writes a message to the output. """
-        with write_lock:
-            msg = "data: {}\n\n".format(payload)
+    def __init__(self):
+        self.queue = queue.Queue(STREAM_QUEUE_SIZE)
+        self.close_reason = None
 
-            try:
-                wfile.write(msg.encode("UTF-8"))
-                wfile.flush()
-            except IOError:
-                block.set()
+    def close(self, reason):
+        """ Asks the request handler of this client to stop. """
+        self.close_reason = reason
 
-    def forward_events(event):
-        """ Forwards events to the open request. """
-        nonlocal gracefully_closed
+        # Wake up the request handler if it is waiting for messages
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
 
-        if block.is_set() or event.event_type == EVENT_TIME_CHANGED:
-            return
-        elif event.event_type == EVENT_HOMEASSISTANT_STOP:
-            gracefully_closed = True
-            block.set()
-            return
 
-        write_message(json.dumps(event, cls=rem.JSONEncoder))
+class StreamBroadcaster(object):
+    """
+    Forwards events to the clients of the event stream. Every event is
+    encoded once and put in a bounded queue per client. The request
+    handler thread of a client writes its queue to the connection. Clients
+    that fall behind are disconnected instead of holding up the bus.
+    """
+
+    def __init__(self, hass):
+        self._lock = threading.Lock()
+        self._clients = []
+
+        hass.bus.listen(MATCH_ALL, self._event_listener)
+
+    def handle_stream(self, handler, path_match, data):
+        """ Provide a streaming interface for the event bus. """
+        client = StreamClient()
+        ping = _stream_message(STREAM_PING_PAYLOAD)
+
+        handler.send_response(HTTP_OK)
+        handler.send_header('Content-type', 'text/event-stream')
+        # The stream only ends when the connection is closed
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+
+        with self._lock:
+            self._clients.append(client)
+
+        message = ping
+
+        try:
+            while client.close_reason is None:
+                handler.wfile.write(message)
+                handler.wfile.flush()
+
+                try:
+                    message = client.queue.get(timeout=STREAM_PING_INTERVAL)
+                except queue.Empty:
+                    message = ping
 
-    handler.send_response(HTTP_OK)
-    handler.send_header('Content-type', 'text/event-stream')
-    handler.end_headers()
+        except IOError:
+            _LOGGER.info("Found broken event stream to %s, cleaning up",
+                         handler.client_address[0])
 
-    hass.bus.listen(MATCH_ALL, forward_events)
+        finally:
+            with self._lock:
+                self._clients.remove(client)
 
-    while True:
-        write_message(STREAM_PING_PAYLOAD)
+        if client.close_reason == CLOSE_REASON_SLOW:
+            _LOGGER.warning(
+                "Disconnected event stream to %s, it fell behind",
+                handler.client_address[0])
 
-        block.wait(STREAM_PING_INTERVAL)
+    def _event_listener(self, event):
+        """ Encodes an event and queues it for every client. """
+        if event.event_type == EVENT_TIME_CHANGED:
+            return
+
+        with self._lock:
+            clients = list(self._clients)
+
+        if not clients:
+            return
 
-        if block.is_set():
-            break
+        if event.event_type == EVENT_HOMEASSISTANT_STOP:
+            for client in clients:
+                client.close(CLOSE_REASON_STOP)
+            return
+
+        message = _stream_message(json.dumps(event, cls=rem.JSONEncoder))
+
+        for client in clients:
+            try:
+                client.queue.put_nowait(message)
+            except queue.Full:
+                client.close(CLOSE_REASON_SLOW)
 
-    if not gracefully_closed:
-        _LOGGER.info("Found broken event stream to %s, cleaning up",
-                     handler.client_address[0])
 
-    hass.bus.remove_listener(MATCH_ALL, forward_events)
+def _stream_message(payload):
+    """ Returns the bytes of a server sent event with payload as data. """
+    return "data: {}\n\n".format(payload).encode("UTF-8")
 
 
 def _handle_get_api_states(handler, path_match, data):
     """ Returns a dict containing all entity ids and their state. """
-    handler.write_json(handler.server.hass.states.all())
+    states = handler.server.hass.states
+
+    if handler.not_modified(states.version):
+        return
+
+    handler.write_json(states.all())
 
 
 def _handle_get_api_states_entity(handler, path_match, data):
     """ Returns the state of a specific entity. """
     entity_id = path_match.group('entity_id')
 
-    state = handler.server.hass.states.get(entity_id)
+    states = handler.server.hass.states
+
+    if handler.not_modified(states.version, entity_id):
+        return
+
+    state = states.get(entity_id)
 
     if state:
         handler.write_json(state)
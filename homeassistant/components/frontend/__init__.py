@@ -7,6 +7,7 @@ Provides a frontend for Home Assistant.
 import re
 import os
 import logging
+import threading
 
 from . import version
 import homeassistant.util as util
@@ -17,8 +18,14 @@ DEPENDENCIES = ['api']
 
 INDEX_PATH = os.path.join(os.path.dirname(__file__), 'index.html.template')
 
+# Rendered index pages to keep, auth comes from the request so bound it
+INDEX_CACHE_SIZE = 10
+
 _LOGGER = logging.getLogger(__name__)
 
+_INDEX_CACHE = {}
+_INDEX_CACHE_LOCK = threading.Lock()
+
 
 def setup(hass, config):
     """ Setup serving the frontend. """
@@ -42,10 +49,6 @@ def setup(hass, config):
 def _handle_get_root(handler, path_match, data):
     """ Renders the debug interface. """
 
-    handler.send_response(HTTP_OK)
-    handler.send_header('Content-type', 'text/html; charset=utf-8')
-    handler.end_headers()
-
     if handler.server.development:
         app_url = "polymer/home-assistant.html"
     else:
@@ -55,13 +58,42 @@ def _handle_get_root(handler, path_match, data):
     auth = ('no_password_set' if handler.server.no_password_set
             else data.get('api_password', ''))
 
+    body = _render_index(app_url, auth)
+
+    handler.send_response(HTTP_OK)
+    handler.send_header('Content-type', 'text/html; charset=utf-8')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+
+    handler.wfile.write(body)
+
+
+def _render_index(app_url, auth):
+    """ Returns the index page for app_url and auth, rendered once until
+        the template changes. """
+    key = (os.path.getmtime(INDEX_PATH), app_url, auth)
+
+    with _INDEX_CACHE_LOCK:
+        body = _INDEX_CACHE.get(key)
+
+    if body is not None:
+        return body
+
     with open(INDEX_PATH) as template_file:
         template_html = template_file.read()
 
     template_html = template_html.replace('{{ app_url }}', app_url)
     template_html = template_html.replace('{{ auth }}', auth)
 
-    handler.wfile.write(template_html.encode("UTF-8"))
+    body = template_html.encode("UTF-8")
+
+    with _INDEX_CACHE_LOCK:
+        if len(_INDEX_CACHE) >= INDEX_CACHE_SIZE:
+            _INDEX_CACHE.clear()
+
+        _INDEX_CACHE[key] = body
+
+    return body
 
 
 def _handle_get_static(handler, path_match, data):
@@ -5,20 +5,42 @@ homeassistant.components.history
 Provide pre-made queries on top of the recorder component.
 """
 import re
+import logging
+import threading
 from datetime import datetime, timedelta
 from itertools import groupby
-from collections import defaultdict
+from collections import defaultdict, deque
 
+import homeassistant.util as util
 import homeassistant.components.recorder as recorder
+from homeassistant.const import (
+    HTTP_BAD_REQUEST, HTTP_HEADER_HA_HISTORY_CURSOR, EVENT_STATE_CHANGED,
+    EVENT_HOMEASSISTANT_STOP)
 
 DOMAIN = 'history'
 DEPENDENCIES = ['recorder', 'http']
 
+CONF_CACHE_STATES = 'cache_states'
+CONF_CACHE_HOURS = 'cache_hours'
+
+DEFAULT_CACHE_STATES = 1000
+DEFAULT_CACHE_HOURS = 24
+
+_LOGGER = logging.getLogger(__name__)
+
+_CACHE = None
+
 
 def last_5_states(entity_id):
     """ Return the last 5 states for entity_id. """
     entity_id = entity_id.lower()
 
+    if _CACHE is not None:
+        states = _CACHE.last_5_states(entity_id)
+
+        if states is not None:
+            return states
+
     query = """
         SELECT * FROM states WHERE entity_id=? AND
         last_changed=last_updated
@@ -28,61 +50,299 @@ def last_5_states(entity_id):
     return recorder.query_states(query, (entity_id, ))
 
 
-def state_changes_during_period(start_time, end_time=None, entity_id=None):
+def state_changes_during_period(start_time, end_time=None, entity_id=None,
+                                entity_ids=None, domains=None):
     """
     Return states changes during period start_time - end_time.
     """
-    where = "last_changed=last_updated AND last_changed > ? "
-    data = [start_time]
+    result = defaultdict(list)
+
+    result.update(state_changes_during_period_iter(
+        start_time, end_time, entity_id, entity_ids, domains))
+
+    return result
+
+
+# pylint: disable=too-many-locals
+def state_changes_during_period_iter(start_time, end_time=None,
+                                     entity_id=None, entity_ids=None,
+                                     domains=None):
+    """
+    Yields per entity, ordered by entity id, a tuple with the entity id and
+    its states during period start_time - end_time. Only the states of one
+    entity are kept in memory at a time.
+    """
+    # Always bound the period. Without an upper bound SQLite prefers walking
+    # the whole states__significant_changes index to satisfy the ORDER BY
+    # instead of a range search on states__state_changes.
+    if end_time is None:
+        end_time = datetime.now() + timedelta(seconds=1)
+
+    entity_ids = [ent_id.lower() for ent_id in entity_ids or ()]
+    domains = [domain.lower() for domain in domains or ()]
+
+    if entity_id is not None:
+        entity_ids.append(entity_id.lower())
+
+    if _CACHE is not None:
+        cached = _CACHE.state_changes(
+            start_time, end_time, entity_ids, domains)
+
+        if cached is not None:
+            yield from cached
+            return
+
+    where = "last_changed=last_updated AND last_changed > ? " \
+            "AND last_changed < ? "
+    data = [start_time, end_time]
+
+    if entity_ids or domains:
+        filter_where, filter_data = _entity_filter(entity_ids, domains)
+        where += "AND ({}) ".format(filter_where)
+        data.extend(filter_data)
+
+    query = ("SELECT * FROM states WHERE {} "
+             "ORDER BY entity_id, last_changed ASC").format(where)
+
+    changes = groupby(recorder.query_states_iter(query, data),
+                      lambda state: state.entity_id)
+
+    # Get the states at the start time
+    if domains:
+        start_states = [
+            state for state in get_states(start_time)
+            if state.entity_id in entity_ids or
+            util.split_entity_id(state.entity_id)[0] in domains]
+    else:
+        start_states = get_states(start_time, entity_ids or None)
+
+    for state in start_states:
+        state.last_changed = start_time
+
+    start_states.sort(key=lambda state: state.entity_id, reverse=True)
+
+    # Merge the start states with the changes, both ordered by entity id
+    for ent_id, group in changes:
+        while start_states and start_states[-1].entity_id < ent_id:
+            state = start_states.pop()
+            yield state.entity_id, [state]
+
+        if start_states and start_states[-1].entity_id == ent_id:
+            states = [start_states.pop()]
+        else:
+            states = []
+
+        states.extend(group)
+
+        yield ent_id, states
+
+    while start_states:
+        state = start_states.pop()
+        yield state.entity_id, [state]
+
+
+def latest_cursor():
+    """ Returns a cursor that points at the most recently recorded state. """
+    row = recorder.query(
+        "SELECT max(state_id) FROM states",
+        return_value=recorder.RETURN_ONE_ROW)
+
+    return row[0] or 0
+
+
+def state_changes_since_cursor(cursor, end_cursor=None, entity_ids=None,
+                               domains=None):
+    """
+    Yields per entity, ordered by entity id, a tuple with the entity id and
+    its state changes recorded after cursor up to and including end_cursor.
+    """
+    entity_ids = [ent_id.lower() for ent_id in entity_ids or ()]
+    domains = [domain.lower() for domain in domains or ()]
+
+    where = "last_changed=last_updated AND state_id > ? "
+    data = [cursor]
+
+    if end_cursor is not None:
+        where += "AND state_id <= ? "
+        data.append(end_cursor)
+
+    if entity_ids or domains:
+        filter_where, filter_data = _entity_filter(entity_ids, domains)
+        where += "AND ({}) ".format(filter_where)
+        data.extend(filter_data)
+
+    query = ("SELECT * FROM states WHERE {} "
+             "ORDER BY entity_id, state_id ASC").format(where)
+
+    for entity_id, group in groupby(recorder.query_states_iter(query, data),
+                                    lambda state: state.entity_id):
+        yield entity_id, list(group)
+
+
+def statistics_during_period(start_time, end_time=None, entity_id=None,
+                             period=recorder.STATISTICS_HOUR):
+    """
+    Return the rolled up statistics of numeric states during period
+    start_time - end_time, grouped by entity id.
+    """
+    where = "period = ? AND start >= ? "
+    data = [period, start_time]
 
     if end_time is not None:
-        where += "AND last_changed < ? "
+        where += "AND start < ? "
         data.append(end_time)
 
     if entity_id is not None:
         where += "AND entity_id = ? "
         data.append(entity_id.lower())
 
-    query = ("SELECT * FROM states WHERE {} "
-             "ORDER BY entity_id, last_changed ASC").format(where)
-
-    states = recorder.query_states(query, data)
+    query = ("SELECT * FROM statistics WHERE {} "
+             "ORDER BY entity_id, start ASC").format(where)
 
     result = defaultdict(list)
 
-    # Get the states at the start time
-    for state in get_states(start_time):
-        state.last_changed = start_time
-        result[state.entity_id].append(state)
+    for row in recorder.query(query, data):
+        statistic = recorder.row_to_statistic(row)
+        statistic['start'] = util.datetime_to_str(statistic['start'])
+
+        result[statistic['entity_id']].append(statistic)
+
+    return result
+
+
+def downsample(states, max_points):
+    """
+    Returns at most max_points of states while keeping the shape. Numeric
+    states use Largest-Triangle-Three-Buckets, other states keep the
+    changes that lasted longest.
+    """
+    if len(states) <= max_points:
+        return states
+
+    try:
+        values = [float(state.state) for state in states]
+    except ValueError:
+        return _downsample_discrete(states, max_points)
+
+    return _downsample_lttb(states, values, max_points)
+
 
-    # Append all changes to it
-    for entity_id, group in groupby(states, lambda state: state.entity_id):
-        result[entity_id].extend(group)
+def _downsample_lttb(states, values, max_points):
+    """ Downsamples numeric states with Largest-Triangle-Three-Buckets. """
+    times = [state.last_changed.timestamp() for state in states]
+
+    # First and last point are always kept, the rest is divided in buckets
+    bucket_size = (len(states) - 2) / (max_points - 2)
+
+    result = [states[0]]
+    previous = 0
+
+    for bucket in range(max_points - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the next bucket, the last point for the last bucket
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(states))
+
+        if next_end <= end:
+            next_end = end + 1
+
+        avg_time = sum(times[end:next_end]) / (next_end - end)
+        avg_value = sum(values[end:next_end]) / (next_end - end)
+
+        # Keep the point that forms the largest triangle with the previous
+        # kept point and the average of the next bucket
+        selected = max(
+            range(start, end),
+            key=lambda idx: abs(
+                (times[previous] - avg_time) * (values[idx] - values[previous])
+                - (times[previous] - times[idx]) *
+                (avg_value - values[previous])))
+
+        result.append(states[selected])
+        previous = selected
+
+    result.append(states[-1])
 
     return result
 
 
+def _downsample_discrete(states, max_points):
+    """ Downsamples states by keeping the changes that lasted longest. """
+    # Drop states that did not change the value
+    changes = [states[0]]
+
+    for state in states[1:]:
+        if state.state != changes[-1].state:
+            changes.append(state)
+
+    if len(changes) <= max_points:
+        return changes
+
+    # Duration of every change except the first and last, which are kept
+    durations = [
+        (changes[idx + 1].last_changed - changes[idx].last_changed, idx)
+        for idx in range(1, len(changes) - 1)]
+
+    keep = sorted(idx for _, idx in sorted(
+        durations, reverse=True)[:max_points - 2])
+
+    return [changes[0]] + [changes[idx] for idx in keep] + [changes[-1]]
+
+
 def get_states(point_in_time, entity_ids=None, run=None):
     """ Returns the states at a specific point in time. """
     if run is None:
         run = recorder.run_information(point_in_time)
 
-    where = run.where_after_start_run + "AND created < ? "
-    where_data = [point_in_time]
-
     if entity_ids is not None:
-        where += "AND entity_id IN ({}) ".format(
+        where_entity_ids = "AND entity_id IN ({}) ".format(
             ",".join(['?'] * len(entity_ids)))
+    else:
+        where_entity_ids = ""
+        entity_ids = []
+
+    # Start from the most recent snapshot so we only have to look at the
+    # states that were created after it.
+    snapshot = recorder.query(
+        "SELECT snapshot_id, created FROM snapshots WHERE {} "
+        "AND created <= ? ORDER BY created DESC LIMIT 1".format(
+            run.where_after_start_run),
+        (point_in_time,), return_value=recorder.RETURN_ONE_ROW)
+
+    if snapshot:
+        where = "created >= ? AND created < ? " + where_entity_ids
+        where_data = [snapshot[0]]
+        where_data.extend(entity_ids)
+        where_data.extend((snapshot[1], point_in_time))
         where_data.extend(entity_ids)
 
-    query = """
-        SELECT * FROM states
-        INNER JOIN (
-            SELECT max(state_id) AS max_state_id
-            FROM states WHERE {}
-            GROUP BY entity_id)
-        WHERE state_id = max_state_id
-    """.format(where)
+        query = """
+            SELECT * FROM states
+            INNER JOIN (
+                SELECT max(state_id) AS max_state_id FROM (
+                    SELECT entity_id, state_id FROM snapshot_states
+                    WHERE snapshot_id = ? {}
+                    UNION ALL
+                    SELECT entity_id, state_id FROM states WHERE {})
+                GROUP BY entity_id)
+            WHERE state_id = max_state_id
+        """.format(where_entity_ids, where)
+
+    else:
+        where = run.where_after_start_run + "AND created < ? " + \
+            where_entity_ids
+        where_data = [point_in_time]
+        where_data.extend(entity_ids)
+
+        query = """
+            SELECT * FROM states
+            INNER JOIN (
+                SELECT max(state_id) AS max_state_id
+                FROM states WHERE {}
+                GROUP BY entity_id)
+            WHERE state_id = max_state_id
+        """.format(where)
 
     return recorder.query_states(query, where_data)
 
@@ -94,8 +354,203 @@ def get_state(point_in_time, entity_id, run=None):
     return states[0] if states else None
 
 
+class HistoryCache(object):
+    """
+    Keeps the recent states of every entity in memory to answer history
+    queries without touching the database.
+
+    Per entity a buffer holds the state that was valid at the time the
+    entity is complete since, followed by all the states after it. The
+    buffer is bounded by max_states and by the window, the oldest states
+    are evicted first.
+    """
+
+    def __init__(self, hass, max_states, window):
+        self.max_states = max_states
+        self.window = window
+        self.lock = threading.Lock()
+
+        # Time since which the buffers of all entities are complete. Rounded
+        # up as the database compares times in whole seconds.
+        self.since = util.strip_microseconds(datetime.now()) + \
+            timedelta(seconds=1)
+
+        self._buffers = {}
+        self._since = {}
+
+        for state in hass.states.all():
+            self._buffers[state.entity_id] = deque((state,))
+            self._since[state.entity_id] = self.since
+
+        hass.bus.listen(EVENT_STATE_CHANGED, self._state_changed_listener)
+
+    def last_5_states(self, entity_id):
+        """ Returns the last 5 state changes of entity_id, newest first.
+            Returns None if less than 5 are cached. """
+        with self.lock:
+            states = [state for state in self._buffers.get(entity_id, ())
+                      if _is_change(state)]
+
+        if len(states) < 5:
+            return None
+
+        return states[:-6:-1]
+
+    def state_changes(self, start_time, end_time, entity_ids, domains):
+        """
+        Returns a list with per entity a tuple with the entity id and its
+        states during the period, ordered by entity id. Returns None if the
+        cache does not have all the states of the period.
+        """
+        start_time = util.strip_microseconds(start_time)
+        end_time = util.strip_microseconds(end_time)
+
+        with self.lock:
+            if not entity_ids and not domains:
+                if start_time < self.since:
+                    return None
+
+                selected = list(self._buffers)
+
+            else:
+                selected = [
+                    entity_id for entity_id in self._buffers
+                    if entity_id in entity_ids or
+                    util.split_entity_id(entity_id)[0] in domains]
+
+                # Requested entities that we have not seen might have
+                # states in the database from before the cache started
+                if (any(entity_id not in self._buffers
+                        for entity_id in entity_ids) and
+                        start_time < self.since) or \
+                   any(start_time < self._since[entity_id]
+                       for entity_id in selected):
+                    return None
+
+            buffers = {entity_id: list(self._buffers[entity_id])
+                       for entity_id in selected}
+
+        result = []
+
+        for entity_id in sorted(buffers):
+            start_state = None
+            states = []
+
+            for state in buffers[entity_id]:
+                if util.strip_microseconds(state.last_updated) < start_time:
+                    start_state = state
+
+                elif (_is_change(state) and
+                      start_time < state.last_changed < end_time):
+                    states.append(state)
+
+            if start_state is not None:
+                start_state = start_state.copy()
+                start_state.last_changed = start_time
+                states.insert(0, start_state)
+
+            if states:
+                result.append((entity_id, states))
+
+        return result
+
+    def _state_changed_listener(self, event):
+        """ Adds the new state to the buffer of its entity. """
+        state = event.data.get('new_state')
+
+        if state is None:
+            return
+
+        with self.lock:
+            if state.entity_id not in self._buffers:
+                self._buffers[state.entity_id] = deque()
+                self._since[state.entity_id] = self.since
+
+            buffer = self._buffers[state.entity_id]
+
+            # Listeners run in parallel, keep the buffer ordered
+            index = len(buffer)
+
+            while index > 0 and \
+                    buffer[index-1].last_updated > state.last_updated:
+                index -= 1
+
+            buffer.insert(index, state)
+
+            self._evict(state.entity_id, state.last_updated - self.window)
+
+    def _evict(self, entity_id, oldest):
+        """ Evicts states of entity_id until it fits in the limits.
+            Expects the lock. """
+        buffer = self._buffers[entity_id]
+        evicted = False
+
+        while len(buffer) > self.max_states or \
+                (len(buffer) > 1 and buffer[1].last_updated <= oldest):
+            buffer.popleft()
+            evicted = True
+
+        if evicted:
+            # From now on the first state is the one we know the start of
+            since = util.strip_microseconds(buffer[0].last_updated)
+
+            self._since[entity_id] = since
+            self.since = max(self.since, since)
+
+
+def _is_change(state):
+    """ Returns if state changed the state instead of only attributes. """
+    return state.last_changed == util.strip_microseconds(state.last_updated)
+
+
+def _entity_filter(entity_ids, domains):
+    """ Returns a where clause and its arguments that match states of
+        entity_ids or of an entity in one of domains. """
+    clauses = []
+    data = []
+
+    if entity_ids:
+        clauses.append("entity_id IN ({})".format(
+            ",".join(['?'] * len(entity_ids))))
+        data.extend(entity_ids)
+
+    # A range instead of LIKE 'domain.%' so it can use an index
+    for domain in domains:
+        clauses.append("(entity_id >= ? AND entity_id < ?)")
+        data.extend((domain + '.', domain + '/'))
+
+    return " OR ".join(clauses), data
+
+
 def setup(hass, config):
     """ Setup history hooks. """
+    # pylint: disable=global-statement
+    global _CACHE
+
+    if not recorder.supports_query():
+        _LOGGER.error(
+            "History requires a recorder backend that supports queries")
+        return False
+
+    conf = config.get(DOMAIN) or {}
+
+    max_states = util.convert(
+        conf.get(CONF_CACHE_STATES), int, DEFAULT_CACHE_STATES)
+
+    if max_states > 0:
+        cache = _CACHE = HistoryCache(
+            hass, max_states, timedelta(hours=util.convert(
+                conf.get(CONF_CACHE_HOURS), int, DEFAULT_CACHE_HOURS)))
+
+        def clear_cache(event):
+            """ Stop answering from the cache of this instance. """
+            global _CACHE
+
+            if _CACHE is cache:
+                _CACHE = None
+
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, clear_cache)
+
     hass.http.register_path(
         'GET',
         re.compile(
@@ -106,6 +561,9 @@ def setup(hass, config):
     hass.http.register_path(
         'GET', re.compile(r'/api/history/period'), _api_history_period)
 
+    hass.http.register_path(
+        'GET', re.compile(r'/api/history/statistics'), _api_history_statistics)
+
     return True
 
 
@@ -114,15 +572,124 @@ def _api_last_5_states(handler, path_match, data):
     """ Return the last 5 states for an entity id as JSON. """
     entity_id = path_match.group('entity_id')
 
+    if handler.not_modified(latest_cursor(), entity_id):
+        return
+
     handler.write_json(last_5_states(entity_id))
 
 
 def _api_history_period(handler, path_match, data):
     """ Return history over a period of time. """
-    # 1 day for now..
-    start_time = datetime.now() - timedelta(seconds=86400)
+    period = _get_period(handler, data)
+
+    if period is None:
+        return
+
+    max_points = util.convert(data.get('max_points'), int)
+
+    if 'max_points' in data and (max_points is None or max_points < 3):
+        handler.write_json_message(
+            "Invalid max_points specified", HTTP_BAD_REQUEST)
+        return
+
+    since_cursor = util.convert(data.get('since_cursor'), int)
+
+    if 'since_cursor' in data and since_cursor is None:
+        handler.write_json_message(
+            "Invalid since_cursor specified", HTTP_BAD_REQUEST)
+        return
+
+    entity_ids = _get_list(data, 'filter_entity_id')
+    domains = _get_list(data, 'filter_domain')
+
+    # Taken before querying so nothing recorded meanwhile is missed by the
+    # next incremental fetch.
+    cursor = latest_cursor()
+
+    if _is_fixed_period(data) and \
+       handler.not_modified(cursor, sorted(data.items())):
+        return
+
+    if since_cursor is None:
+        history_iter = state_changes_during_period_iter(
+            period[0], period[1], entity_ids=entity_ids, domains=domains)
+
+    else:
+        history_iter = state_changes_since_cursor(
+            since_cursor, cursor, entity_ids, domains)
+
+    if max_points is None:
+        items = (states for _, states in history_iter)
+
+    else:
+        items = (downsample(states, max_points)
+                 for _, states in history_iter)
+
+    handler.write_json_stream(
+        items, headers={HTTP_HEADER_HA_HISTORY_CURSOR: cursor})
+
+
+def _api_history_statistics(handler, path_match, data):
+    """ Return rolled up statistics over a period of time. """
+    period = data.get('period', recorder.STATISTICS_HOUR)
+
+    if period not in recorder.STATISTICS_PERIODS:
+        handler.write_json_message(
+            "Invalid period specified", HTTP_BAD_REQUEST)
+        return
+
+    time_period = _get_period(handler, data)
+
+    if time_period is None:
+        return
+
+    if _is_fixed_period(data) and \
+       handler.not_modified(latest_cursor(), sorted(data.items())):
+        return
 
     entity_id = data.get('filter_entity_id')
 
     handler.write_json(
-        state_changes_during_period(start_time, entity_id=entity_id).values())
+        statistics_during_period(
+            time_period[0], time_period[1], entity_id, period).values())
+
+
+def _is_fixed_period(data):
+    """ Returns if the response to a request only depends on what got
+        recorded. Without a start time the period moves with the current
+        time. """
+    return 'start_time' in data or 'since_cursor' in data
+
+
+def _get_period(handler, data):
+    """ Returns start_time and end_time from the request data. Start time
+        defaults to 1 day ago. Writes an error and returns None if a time
+        is invalid. """
+    times = []
+
+    for key in ('start_time', 'end_time'):
+        value = data.get(key)
+
+        if value is None:
+            times.append(None)
+            continue
+
+        point_in_time = util.str_to_datetime(value)
+
+        if point_in_time is None:
+            handler.write_json_message(
+                "Invalid {} specified".format(key), HTTP_BAD_REQUEST)
+            return None
+
+        times.append(point_in_time)
+
+    if times[0] is None:
+        times[0] = datetime.now() - timedelta(seconds=86400)
+
+    return times
+
+
+def _get_list(data, key):
+    """ Returns the comma separated values of key in data. """
+    return [value.strip() for value in data.get(key, '').split(',')
+            if value.strip()]
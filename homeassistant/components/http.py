@@ -71,11 +71,14 @@ Example result:
 
 """
 
+import re
 import json
 import threading
 import logging
 import time
 import gzip
+import zlib
+import hashlib
 import os
 from http.server import SimpleHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
@@ -86,8 +89,10 @@ from homeassistant.const import (
     SERVER_PORT, CONTENT_TYPE_JSON,
     HTTP_HEADER_HA_AUTH, HTTP_HEADER_CONTENT_TYPE, HTTP_HEADER_ACCEPT_ENCODING,
     HTTP_HEADER_CONTENT_ENCODING, HTTP_HEADER_VARY, HTTP_HEADER_CONTENT_LENGTH,
-    HTTP_HEADER_CACHE_CONTROL, HTTP_HEADER_EXPIRES, HTTP_OK, HTTP_UNAUTHORIZED,
-    HTTP_NOT_FOUND, HTTP_METHOD_NOT_ALLOWED, HTTP_UNPROCESSABLE_ENTITY)
+    HTTP_HEADER_CACHE_CONTROL, HTTP_HEADER_EXPIRES, HTTP_HEADER_CONNECTION,
+    HTTP_HEADER_TRANSFER_ENCODING, HTTP_HEADER_ETAG, HTTP_HEADER_IF_NONE_MATCH,
+    HTTP_OK, HTTP_NOT_MODIFIED, HTTP_UNAUTHORIZED, HTTP_NOT_FOUND,
+    HTTP_METHOD_NOT_ALLOWED, HTTP_UNPROCESSABLE_ENTITY)
 import homeassistant.remote as rem
 import homeassistant.util as util
 import homeassistant.bootstrap as bootstrap
@@ -101,6 +106,19 @@ CONF_SERVER_PORT = "server_port"
 CONF_DEVELOPMENT = "development"
 
 DATA_API_PASSWORD = 'api_password'
+DATA_PRETTY = 'pretty'
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+# Supported content encodings, most preferred first, with the window bits
+# of their zlib container
+CONTENT_ENCODINGS = (('gzip', 31), ('deflate', 15))
+
+# Seconds an idle persistent connection is kept open
+KEEP_ALIVE_TIMEOUT = 15
+# Requests served over one connection before it is closed
+KEEP_ALIVE_MAX_REQUESTS = 100
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -157,7 +175,12 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
         self.api_password = api_password
         self.development = development
         self.no_password_set = no_password_set
-        self.paths = []
+        self.routes = RouteTable()
+
+        # Part of every ETag so tags do not survive a restart
+        self.instance_id = util.get_random_string(8)
+
+        self.file_cache = StaticFileCache()
 
         # We will lazy init this one if needed
         self.event_forwarder = None
@@ -183,7 +206,243 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
 
     def register_path(self, method, url, callback, require_auth=True):
         """ Regitsters a path wit the server. """
-        self.paths.append((method, url, callback, require_auth))
+        self.routes.add(method, url, callback, require_auth)
+
+
+class StaticFileCache(object):
+    """
+    Keeps the gzip compressed content of served files in memory so files
+    are only compressed once. An entry is replaced when the modification
+    time or size of its file changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Path -> ((mtime, size), gzip compressed content)
+        self._files = {}
+
+    def get_gzip(self, path, inp):
+        """ Returns the gzip compressed content of inp, the opened file at
+            path. """
+        fst = os.fstat(inp.fileno())
+        version = (fst.st_mtime, fst.st_size)
+
+        with self._lock:
+            entry = self._files.get(path)
+
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        gzip_data = gzip.compress(inp.read())
+
+        with self._lock:
+            self._files[path] = (version, gzip_data)
+
+        return gzip_data
+
+
+# Regular expressions the route table can store in its tree: literal
+# characters and named groups of one or more characters of a class.
+_ROUTE_LITERAL = re.compile(r'[a-zA-Z0-9_/\-]|\\[^a-zA-Z0-9]')
+_ROUTE_PARAM = re.compile(r'\(\?P<(?P<name>\w+)>\[(?P<class>[^\]]+)\]\+\)')
+_ROUTE_CLASS = re.compile(r'(\\.|[^\\])(?:-(\\.|[^\\]))?')
+
+
+class RouteMatch(object):
+    """ The values of the path parameters of a matched route. Mimics the
+        part of a regular expression match that handlers use. """
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ['_params']
+
+    def __init__(self, params):
+        self._params = params
+
+    def group(self, name):
+        """ Returns the value of path parameter name. """
+        return self._params[name]
+
+    def groupdict(self):
+        """ Returns all path parameters. """
+        return dict(self._params)
+
+
+class _RouteNode(object):
+    """ A node in the route tree. """
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ['children', 'params', 'exact', 'prefix']
+
+    def __init__(self):
+        # Next character -> node
+        self.children = {}
+        # List of (name, characters, node)
+        self.params = []
+        # Method -> (index, route) of routes ending at this node that have to
+        # match the whole path and that may match a prefix of the path
+        self.exact = {}
+        self.prefix = {}
+
+
+class RouteTable(object):
+    """
+    Finds the handler of a request path.
+
+    Routes are stored in a prefix tree with a branch per character and
+    typed parameter nodes for named groups like (?P<entity_id>[a-z_.]+),
+    so a lookup is linear in the length of the path. Regular expressions
+    that can not be expressed in the tree are matched one by one.
+
+    Matches behave like before: string routes match the whole path, regular
+    expressions match the start of the path and the first registered route
+    wins.
+    """
+
+    def __init__(self):
+        self._root = _RouteNode()
+        self._regex_routes = []
+        self._count = 0
+
+    def add(self, method, url, callback, require_auth=True):
+        """ Adds a route. url is a string or a compiled regular expression. """
+        route = (callback, require_auth)
+        index = self._count
+        self._count += 1
+
+        if isinstance(url, str):
+            parts = list(url)
+            exact = True
+        else:
+            parts = _parse_route_regex(url.pattern)
+            exact = False
+
+        if parts is None:
+            self._regex_routes.append((index, method, url, route))
+            return
+
+        node = self._root
+
+        for part in parts:
+            if isinstance(part, str):
+                node = node.children.setdefault(part, _RouteNode())
+                continue
+
+            name, characters = part
+
+            for param_name, param_characters, param_node in node.params:
+                if param_name == name and param_characters == characters:
+                    node = param_node
+                    break
+            else:
+                param_node = _RouteNode()
+                node.params.append((name, characters, param_node))
+                node = param_node
+
+        routes = node.exact if exact else node.prefix
+        routes.setdefault(method, (index, route))
+
+    def lookup(self, method, path):
+        """
+        Returns a tuple (status, route, path_match). Status is HTTP_OK if a
+        route matched, HTTP_METHOD_NOT_ALLOWED if a route matched the path
+        but not the method and HTTP_NOT_FOUND otherwise. Route is a tuple
+        (callback, require_auth).
+        """
+        candidates = []
+
+        self._lookup(self._root, path, 0, {}, candidates)
+
+        for index, t_method, url, route in self._regex_routes:
+            path_match = url.match(path)
+
+            if path_match:
+                candidates.append(({t_method: (index, route)}, path_match))
+
+        best = None
+
+        for routes, path_match in candidates:
+            found = routes.get(method)
+
+            if found is not None and (best is None or found[0] < best[0]):
+                best = (found[0], found[1], path_match)
+
+        if best is not None:
+            return HTTP_OK, best[1], best[2]
+
+        elif candidates:
+            return HTTP_METHOD_NOT_ALLOWED, None, None
+
+        return HTTP_NOT_FOUND, None, None
+
+    # pylint: disable=too-many-arguments
+    def _lookup(self, node, path, pos, params, candidates, with_prefix=True):
+        """ Collects the routes of node and its descendants that match path
+            from position pos. """
+        if with_prefix and node.prefix:
+            candidates.append((node.prefix, RouteMatch(params)))
+
+        if pos == len(path):
+            if node.exact:
+                candidates.append((node.exact, RouteMatch(params)))
+            return
+
+        child = node.children.get(path[pos])
+
+        if child is not None:
+            self._lookup(child, path, pos + 1, params, candidates)
+
+        for name, characters, param_node in node.params:
+            end = pos
+
+            while end < len(path) and path[end] in characters:
+                end += 1
+
+            # Greedy like the regular expression, routes that do not match
+            # get to try shorter values. Candidates found first win.
+            for param_end in range(end, pos, -1):
+                param_params = dict(params)
+                param_params[name] = path[pos:param_end]
+
+                # Prefix routes ending here already matched the longest value
+                self._lookup(param_node, path, param_end, param_params,
+                             candidates, param_end == end)
+
+
+def _parse_route_regex(pattern):
+    """ Returns the parts of a route regular expression: literal characters
+        and (name, characters) tuples for named groups. Returns None if the
+        expression can not be stored in the route tree. """
+    parts = []
+    pos = 0
+
+    while pos < len(pattern):
+        literal = _ROUTE_LITERAL.match(pattern, pos)
+
+        if literal:
+            parts.append(literal.group()[-1])
+            pos = literal.end()
+            continue
+
+        param = _ROUTE_PARAM.match(pattern, pos)
+
+        # Negated classes and escapes like \d are left to the regex engine
+        if param is None or param.group('class').startswith('^') or \
+           re.search(r'\\[a-zA-Z0-9]', param.group('class')):
+            return None
+
+        characters = set()
+
+        for char_range in _ROUTE_CLASS.finditer(param.group('class')):
+            first = char_range.group(1)[-1]
+            last = (char_range.group(2) or first)[-1]
+
+            characters.update(
+                chr(char) for char in range(ord(first), ord(last) + 1))
+
+        parts.append((param.group('name'), frozenset(characters)))
+        pos = param.end()
+
+    return parts
 
 
 # pylint: disable=too-many-public-methods,too-many-locals
@@ -197,8 +456,39 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
     server_version = "HomeAssistant/1.0"
 
+    # Keep connections open between requests. This requires every response
+    # to either have a Content-Length, be chunked or close the connection.
+    protocol_version = "HTTP/1.1"
+
+    # Closes idle connections, applies to every read from the socket
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    max_requests = KEEP_ALIVE_MAX_REQUESTS
+
+    # Indent JSON responses, set per request with the pretty parameter
+    pretty_json = False
+
+    # ETag of the response, set by not_modified
+    etag = None
+
+    def setup(self):
+        """ Prepares handling the requests of a new connection. """
+        super().setup()
+
+        self.requests_handled = 0
+
+    def send_response(self, code, message=None):
+        """ Sends the response line and closes the connection after the
+            last allowed request. """
+        super().send_response(code, message)
+
+        if self.requests_handled >= self.max_requests:
+            self.send_header(HTTP_HEADER_CONNECTION, 'close')
+
     def _handle_request(self, method):  # pylint: disable=too-many-branches
         """ Does some common checks and calls appropriate method. """
+        self.requests_handled += 1
+
         url = urlparse(self.path)
 
         # Read query input
@@ -208,6 +498,9 @@ class RequestHandler(SimpleHTTPRequestHandler):
         for key in data:
             data[key] = data[key][-1]
 
+        self.pretty_json = data.pop(DATA_PRETTY, '0') not in ('', '0')
+        self.etag = None
+
         # Did we get post input ?
         content_length = int(self.headers.get(HTTP_HEADER_CONTENT_LENGTH, 0))
 
@@ -236,34 +529,11 @@ class RequestHandler(SimpleHTTPRequestHandler):
         if '_METHOD' in data:
             method = data.pop('_METHOD')
 
-        # Var to keep track if we found a path that matched a handler but
-        # the method was different
-        path_matched_but_not_method = False
-
-        # Var to hold the handler for this path and method if found
-        handle_request_method = False
-        require_auth = True
-
-        # Check every handler to find matching result
-        for t_method, t_path, t_handler, t_auth in self.server.paths:
-            # we either do string-comparison or regular expression matching
-            # pylint: disable=maybe-no-member
-            if isinstance(t_path, str):
-                path_match = url.path == t_path
-            else:
-                path_match = t_path.match(url.path)
-
-            if path_match and method == t_method:
-                # Call the method
-                handle_request_method = t_handler
-                require_auth = t_auth
-                break
-
-            elif path_match:
-                path_matched_but_not_method = True
+        status, route, path_match = self.server.routes.lookup(method, url.path)
 
         # Did we find a handler for the incoming request?
-        if handle_request_method:
+        if status == HTTP_OK:
+            handle_request_method, require_auth = route
 
             # For some calls we need a valid password
             if require_auth and api_password != self.server.api_password:
@@ -273,12 +543,9 @@ class RequestHandler(SimpleHTTPRequestHandler):
             else:
                 handle_request_method(self, path_match, data)
 
-        elif path_matched_but_not_method:
-            self.send_response(HTTP_METHOD_NOT_ALLOWED)
-            self.end_headers()
-
         else:
-            self.send_response(HTTP_NOT_FOUND)
+            self.send_response(status)
+            self.send_header(HTTP_HEADER_CONTENT_LENGTH, '0')
             self.end_headers()
 
     def do_HEAD(self):  # pylint: disable=invalid-name
@@ -307,47 +574,195 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
     def write_json(self, data=None, status_code=HTTP_OK, location=None):
         """ Helper method to return JSON to the caller. """
+        body = b'' if data is None else self._encode_json(data)
+
+        encoding = self._content_encoding()
+
         self.send_response(status_code)
         self.send_header(HTTP_HEADER_CONTENT_TYPE, CONTENT_TYPE_JSON)
+        self.send_header(HTTP_HEADER_VARY, HTTP_HEADER_ACCEPT_ENCODING)
+
+        if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+            compressor = zlib.compressobj(wbits=encoding[1])
+            body = compressor.compress(body) + compressor.flush()
+
+            self.send_header(HTTP_HEADER_CONTENT_ENCODING, encoding[0])
+
+        self.send_header(HTTP_HEADER_CONTENT_LENGTH, str(len(body)))
+
+        if self.etag is not None:
+            self.send_header(HTTP_HEADER_ETAG, self.etag)
 
         if location:
             self.send_header('Location', location)
 
         self.end_headers()
 
-        if data is not None:
-            self.wfile.write(
-                json.dumps(data, indent=4, sort_keys=True,
-                           cls=rem.JSONEncoder).encode("UTF-8"))
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def write_json_stream(self, items, status_code=HTTP_OK, headers=None):
+        """
+        Helper method to return a JSON list to the caller. Items are
+        encoded and written one at a time so the list is never completely
+        in memory. HTTP/1.1 clients get a chunk per item, for others the end
+        of the response is marked by closing the connection.
+        """
+        chunked = self.request_version == 'HTTP/1.1'
+
+        # The size is not known upfront so always compress if we can
+        encoding = self._content_encoding()
+
+        self.send_response(status_code)
+        self.send_header(HTTP_HEADER_CONTENT_TYPE, CONTENT_TYPE_JSON)
+        self.send_header(HTTP_HEADER_VARY, HTTP_HEADER_ACCEPT_ENCODING)
+
+        if encoding is not None:
+            self.send_header(HTTP_HEADER_CONTENT_ENCODING, encoding[0])
+
+        if chunked:
+            self.send_header(HTTP_HEADER_TRANSFER_ENCODING, 'chunked')
+        else:
+            self.send_header(HTTP_HEADER_CONNECTION, 'close')
+
+        if self.etag is not None:
+            self.send_header(HTTP_HEADER_ETAG, self.etag)
+
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return
+
+        write_raw = self._write_chunk if chunked else self.wfile.write
+
+        if encoding is None:
+            write = write_raw
+
+        else:
+            compressor = zlib.compressobj(wbits=encoding[1])
+
+            def write(data):
+                """ Compresses data and flushes it to the client. """
+                write_raw(compressor.compress(data) +
+                          compressor.flush(zlib.Z_SYNC_FLUSH))
+
+        separator = b'['
+
+        for item in items:
+            write(separator + self._encode_json(item))
+
+            separator = b','
+
+        write(b']' if separator == b',' else b'[]')
+
+        if encoding is not None:
+            write_raw(compressor.flush())
+
+        if chunked:
+            self._write_chunk(b'')
+
+    def not_modified(self, *version):
+        """
+        Tags the response with an ETag for version, which identifies the
+        content of the requested resource. Returns True after responding
+        with 304 Not Modified if the client already has this version.
+        """
+        self.etag = 'W/"{}-{}"'.format(
+            self.server.instance_id,
+            hashlib.sha1(repr(version).encode("UTF-8")).hexdigest())
+
+        if_none_match = self.headers.get(HTTP_HEADER_IF_NONE_MATCH)
+
+        if if_none_match is None:
+            return False
+
+        # Weak comparison, the representation may differ in encoding
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+
+        if '*' not in tags and self.etag[2:] not in \
+                (tag[2:] if tag.startswith('W/') else tag for tag in tags):
+            return False
+
+        self.send_response(HTTP_NOT_MODIFIED)
+        self.send_header(HTTP_HEADER_ETAG, self.etag)
+        self.send_header(HTTP_HEADER_VARY, HTTP_HEADER_ACCEPT_ENCODING)
+        self.end_headers()
+
+        return True
+
+    def _encode_json(self, data):
+        """ Encodes data as compact JSON, or indented if asked for. """
+        if self.pretty_json:
+            return json.dumps(data, indent=4, sort_keys=True,
+                              cls=rem.JSONEncoder).encode("UTF-8")
+
+        return json.dumps(data, separators=(',', ':'),
+                          cls=rem.JSONEncoder).encode("UTF-8")
+
+    def _content_encoding(self):
+        """ Returns a tuple with the name and zlib window bits of the
+            preferred encoding the client accepts, None for no encoding. """
+        accepted = set()
+        header = self.headers.get(HTTP_HEADER_ACCEPT_ENCODING, '')
+
+        for value in header.split(','):
+            coding, _, params = value.partition(';')
+            params = params.replace(' ', '')
+
+            # Encodings with q=0 are explicitly not acceptable
+            if params.startswith('q=') and not util.convert(
+                    params[2:], float, 0):
+                continue
+
+            accepted.add(coding.strip().lower())
+
+        for encoding in CONTENT_ENCODINGS:
+            if encoding[0] in accepted:
+                return encoding
+
+        return None
+
+    def _write_chunk(self, data):
+        """ Writes data as a chunk, empty data ends the response. """
+        self.wfile.write(
+            "{:X}\r\n".format(len(data)).encode("UTF-8") + data + b"\r\n")
 
     def write_file(self, path):
         """ Returns a file to the user. """
         try:
             with open(path, 'rb') as inp:
-                self.write_file_pointer(self.guess_type(path), inp)
+                self.write_file_pointer(self.guess_type(path), inp, path)
 
         except IOError:
             self.send_response(HTTP_NOT_FOUND)
+            self.send_header(HTTP_HEADER_CONTENT_LENGTH, '0')
             self.end_headers()
             _LOGGER.exception("Unable to serve %s", path)
 
-    def write_file_pointer(self, content_type, inp):
+    def write_file_pointer(self, content_type, inp, path=None):
         """
         Helper function to write a file pointer to the user.
-        Does not do error handling.
+        Does not do error handling. If the path of the file is given its
+        compressed content is cached.
         """
         do_gzip = 'gzip' in self.headers.get(HTTP_HEADER_ACCEPT_ENCODING, '')
 
         self.send_response(HTTP_OK)
         self.send_header(HTTP_HEADER_CONTENT_TYPE, content_type)
+        self.send_header(HTTP_HEADER_VARY, HTTP_HEADER_ACCEPT_ENCODING)
 
         self.set_cache_header()
 
         if do_gzip:
-            gzip_data = gzip.compress(inp.read())
+            if path is None:
+                gzip_data = gzip.compress(inp.read())
+            else:
+                gzip_data = self.server.file_cache.get_gzip(path, inp)
 
             self.send_header(HTTP_HEADER_CONTENT_ENCODING, "gzip")
-            self.send_header(HTTP_HEADER_VARY, HTTP_HEADER_ACCEPT_ENCODING)
             self.send_header(HTTP_HEADER_CONTENT_LENGTH, str(len(gzip_data)))
 
         else:
@@ -363,7 +778,8 @@ class RequestHandler(SimpleHTTPRequestHandler):
             self.wfile.write(gzip_data)
 
         else:
-            self.copyfile(inp, self.wfile)
+            # Let the kernel copy the file to the socket if it can
+            self.connection.sendfile(inp)
 
     def set_cache_header(self):
         """ Add cache headers if not in development """
@@ -0,0 +1,601 @@
+"""
+homeassistant.components.recorder
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Component that records all events and state changes.
+Allows other components to query this database.
+
+Storage is handled by a backend. The default sqlite backend supports
+arbitrary SQL queries. The segment backend writes append-only files with one
+file per day which are cheap to write on flash storage and to expire.
+"""
+import logging
+import threading
+import queue
+from datetime import datetime
+import time
+import json
+import os
+
+from homeassistant import Event, EventOrigin, State, HomeAssistantError
+import homeassistant.util as util
+from homeassistant.remote import JSONEncoder
+from homeassistant.const import (
+    MATCH_ALL, EVENT_TIME_CHANGED, EVENT_STATE_CHANGED,
+    EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP)
+
+DOMAIN = "recorder"
+DEPENDENCIES = []
+
+DB_FILE = 'home-assistant.db'
+SPILL_FILE = 'home-assistant.db.spill'
+
+CONF_QUEUE_SIZE = 'queue_size'
+CONF_OVERFLOW = 'overflow'
+CONF_BACKEND = 'backend'
+CONF_KEEP_DAYS = 'keep_days'
+
+BACKEND_SQLITE = 'sqlite'
+BACKEND_SEGMENT = 'segment'
+
+DEFAULT_QUEUE_SIZE = 10000
+
+# What to do with new events when the queue is full
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+RETURN_ROWCOUNT = "rowcount"
+RETURN_LASTROWID = "lastrowid"
+RETURN_ONE_ROW = "one_row"
+
+# Number of rows fetched at once when streaming query results
+QUERY_CHUNK_SIZE = 500
+
+# Periods for which numeric states are rolled up and their length in seconds
+STATISTICS_5MINUTE = "5minute"
+STATISTICS_HOUR = "hour"
+STATISTICS_PERIODS = {
+    STATISTICS_5MINUTE: 300,
+    STATISTICS_HOUR: 3600,
+}
+
+_INSTANCE = None
+_LOGGER = logging.getLogger(__name__)
+
+
+def query(sql_query, arguments=None, return_value=None):
+    """ Query the database. """
+    _verify_instance()
+
+    return _INSTANCE.query(sql_query, arguments, return_value)
+
+
+def query_iter(sql_query, arguments=None, chunk_size=QUERY_CHUNK_SIZE):
+    """ Query the database and yield the rows as they are fetched. """
+    _verify_instance()
+
+    return _INSTANCE.query_iter(sql_query, arguments, chunk_size)
+
+
+def query_states(state_query, arguments=None):
+    """ Query the database and return a list of states. """
+    return [
+        row for row in
+        (row_to_state(row) for row in query(state_query, arguments))
+        if row is not None]
+
+
+def query_states_iter(state_query, arguments=None):
+    """ Query the database and yield states. The attributes of the states
+        are only decoded when accessed. """
+    for row in query_iter(state_query, arguments):
+        yield LazyState(
+            row[1], row[2], row[3], datetime.fromtimestamp(row[4]))
+
+
+def query_events(event_query, arguments=None):
+    """ Query the database and return a list of states. """
+    return [
+        row for row in
+        (row_to_event(row) for row in query(event_query, arguments))
+        if row is not None]
+
+
+def query_events_iter(event_query, arguments=None):
+    """ Query the database and yield events. """
+    for row in query_iter(event_query, arguments):
+        event = row_to_event(row)
+
+        if event is not None:
+            yield event
+
+
+def row_to_state(row):
+    """ Convert a databsae row to a state. """
+    try:
+        return State(
+            row[1], row[2], json.loads(row[3]), datetime.fromtimestamp(row[4]))
+    except ValueError:
+        # When json.loads fails
+        _LOGGER.exception("Error converting row to state: %s", row)
+        return None
+
+
+def row_to_event(row):
+    """ Convert a databse row to an event. """
+    try:
+        return Event(row[1], json.loads(row[2]), EventOrigin[row[3].lower()])
+    except ValueError:
+        # When json.oads fails
+        _LOGGER.exception("Error converting row to event: %s", row)
+        return None
+
+
+def spill_line_to_event(line):
+    """ Convert a line of the spill file back to an event. """
+    try:
+        event_dict = json.loads(line)
+    except ValueError:
+        _LOGGER.exception("Error converting spilled event: %s", line)
+        return None
+
+    event_data = event_dict['data']
+
+    # Restore the states that an EVENT_STATE_CHANGED carries
+    if event_dict['event_type'] == EVENT_STATE_CHANGED:
+        for key in ('old_state', 'new_state'):
+            state = State.from_dict(event_data.get(key))
+
+            if state:
+                event_data[key] = state
+
+    return Event(event_dict['event_type'], event_data,
+                 EventOrigin[event_dict['origin'].lower()])
+
+
+def row_to_statistic(row):
+    """ Convert a database row to a statistics dict. """
+    return {
+        'entity_id': row[1],
+        'period': row[2],
+        'start': datetime.fromtimestamp(row[3]),
+        'min': row[4],
+        'max': row[5],
+        'mean': row[6],
+        'last': row[7],
+        'count': row[8],
+    }
+
+
+def run_information(point_in_time=None):
+    """ Returns information about current run or the run that
+        covers point_in_time. """
+    _verify_instance()
+
+    if point_in_time is None or point_in_time > _INSTANCE.recording_start:
+        return RecorderRun()
+
+    run = _INSTANCE.query(
+        "SELECT * FROM recorder_runs WHERE start>? AND END IS NULL OR END<?",
+        (point_in_time, point_in_time), return_value=RETURN_ONE_ROW)
+
+    return RecorderRun(run) if run else None
+
+
+def read_states(start_time, end_time=None, entity_id=None):
+    """ Yields the states that were recorded during a period.
+        Supported by all storage backends. """
+    _verify_instance()
+
+    return _INSTANCE.backend.read_states(start_time, end_time, entity_id)
+
+
+def supports_query():
+    """ Returns if the storage backend supports SQL queries. """
+    _verify_instance()
+
+    return _INSTANCE.backend.supports_query
+
+
+def metrics():
+    """ Returns health metrics of the recorder. """
+    _verify_instance()
+
+    return _INSTANCE.metrics()
+
+
+def setup(hass, config):
+    """ Setup the recorder. """
+    # pylint: disable=global-statement
+    global _INSTANCE
+
+    conf = config.get(DOMAIN) or {}
+
+    queue_size = util.convert(
+        conf.get(CONF_QUEUE_SIZE), int, DEFAULT_QUEUE_SIZE)
+    overflow = conf.get(CONF_OVERFLOW, OVERFLOW_BLOCK)
+
+    if overflow not in OVERFLOW_POLICIES:
+        _LOGGER.error(
+            "Invalid overflow policy %s, expected one of %s",
+            overflow, ", ".join(OVERFLOW_POLICIES))
+        return False
+
+    # The backends build on this module so import them here
+    from homeassistant.components.recorder import sqlite, segment
+
+    backends = {
+        BACKEND_SQLITE: sqlite.SQLiteBackend,
+        BACKEND_SEGMENT: segment.SegmentBackend,
+    }
+
+    backend_type = conf.get(CONF_BACKEND, BACKEND_SQLITE)
+
+    if backend_type not in backends:
+        _LOGGER.error(
+            "Invalid backend %s, expected one of %s",
+            backend_type, ", ".join(backends))
+        return False
+
+    _INSTANCE = Recorder(
+        hass, backends[backend_type], conf, queue_size, overflow)
+
+    return True
+
+
+class RecorderRun(object):
+    """ Represents a recorder run. """
+    def __init__(self, row=None):
+        self.end = None
+
+        if row is None:
+            self.start = _INSTANCE.recording_start
+            self.closed_incorrect = False
+        else:
+            self.start = datetime.fromtimestamp(row[1])
+
+            if row[2] is not None:
+                self.end = datetime.fromtimestamp(row[2])
+
+            self.closed_incorrect = bool(row[3])
+
+    def entity_ids(self, point_in_time=None):
+        """
+        Return the entity ids that existed in this run.
+        Specify point_in_time if you want to know which existed at that point
+        in time inside the run.
+        """
+        where = self.where_after_start_run
+        where_data = []
+
+        if point_in_time is not None or self.end is not None:
+            where += "AND created < ? "
+            where_data.append(point_in_time or self.end)
+
+        return [row[0] for row in query(
+            "SELECT entity_id FROM states WHERE {}"
+            "GROUP BY entity_id".format(where), where_data)]
+
+    @property
+    def where_after_start_run(self):
+        """ Returns SQL WHERE clause to select rows
+            created after the start of the run. """
+        return "created >= {} ".format(_adapt_datetime(self.start))
+
+    @property
+    def where_limit_to_run(self):
+        """ Return a SQL WHERE clause to limit results to this run. """
+        where = self.where_after_start_run
+
+        if self.end is not None:
+            where += "AND created < {} ".format(_adapt_datetime(self.end))
+
+        return where
+
+
+class LazyState(State):
+    """ State read from the database that decodes its attributes when they
+        are accessed for the first time. """
+
+    __slots__ = ['_attributes', '_attributes_json']
+
+    def __init__(self, entity_id, state, attributes_json, last_changed):
+        super().__init__(entity_id, state, None, last_changed)
+
+        self._attributes = None
+        self._attributes_json = attributes_json
+
+    @property
+    def attributes(self):
+        """ Returns the attributes, decoding them if needed. """
+        if self._attributes is None:
+            try:
+                self._attributes = json.loads(self._attributes_json)
+            except ValueError:
+                # When json.loads fails
+                _LOGGER.exception(
+                    "Error decoding attributes of %s: %s",
+                    self.entity_id, self._attributes_json)
+                self._attributes = {}
+
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, value):
+        """ Sets the attributes. """
+        self._attributes = value
+
+
+class StorageBackend(object):
+    """ ABC for recorder storage backends.
+
+    All writing methods are called from the recorder thread. """
+    # pylint: disable=no-self-use,unused-argument
+
+    # If the backend can run SQL queries via query and query_iter
+    supports_query = False
+
+    def __init__(self, hass, recording_start, config=None):
+        self.hass = hass
+        self.recording_start = recording_start
+        self.config = config or {}
+
+    def setup(self):
+        """ Prepares the storage for recording. """
+        raise NotImplementedError
+
+    def close(self):
+        """ Flushes and closes the storage. """
+        raise NotImplementedError
+
+    def record_state(self, entity_id, state, now):
+        """ Stores a state. State is None if the entity got removed. """
+        raise NotImplementedError
+
+    def record_event(self, event, now):
+        """ Stores an event. """
+        raise NotImplementedError
+
+    def read_states(self, start_time, end_time=None, entity_id=None):
+        """ Yields the states recorded during a period in order. """
+        raise NotImplementedError
+
+    def purge(self, keep_days):
+        """ Removes everything recorded more than keep_days ago. """
+        raise NotImplementedError
+
+    def query(self, sql_query, data=None, return_value=None):
+        """ Query the storage using SQL. """
+        raise HomeAssistantError(
+            "The {} backend does not support queries".format(
+                self.__class__.__name__))
+
+    def query_iter(self, sql_query, data=None, chunk_size=QUERY_CHUNK_SIZE):
+        """ Query the storage using SQL and yield the rows. """
+        raise HomeAssistantError(
+            "The {} backend does not support queries".format(
+                self.__class__.__name__))
+
+
+class Recorder(threading.Thread):
+    """
+    Threaded recorder
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, hass, backend_class, config=None, queue_size=0,
+                 overflow=OVERFLOW_BLOCK):
+        threading.Thread.__init__(self)
+
+        self.hass = hass
+        self.queue = queue.Queue(queue_size)
+        self.overflow = overflow
+        self.quit_object = object()
+        self.recording_start = datetime.now()
+        self.backend = backend_class(hass, self.recording_start, config)
+
+        config = config or {}
+        self.keep_days = util.convert(config.get(CONF_KEEP_DAYS), int)
+        self._last_purge = None
+
+        # Once the queue overflows with the spill policy, new events are
+        # appended to the spill file until the recorder has caught up.
+        self._spill_path = hass.get_config_path(SPILL_FILE)
+        self._replay_path = self._spill_path + '.replay'
+        self._spill_lock = threading.Lock()
+        self._spilling = (os.path.isfile(self._spill_path) or
+                          os.path.isfile(self._replay_path))
+
+        self._events_dropped = 0
+        self._events_spilled = 0
+        self._events_recorded = 0
+        self._write_time = 0
+        self._write_time_max = 0
+
+        def start_recording(event):
+            """ Start recording. """
+            self.start()
+
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_START, start_recording)
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, self.shutdown)
+        hass.bus.listen(MATCH_ALL, self.event_listener)
+
+    def run(self):
+        """ Start processing events to save. """
+        self.backend.setup()
+
+        while True:
+            if self._spilling and self.queue.empty():
+                self._replay_spill()
+
+            event = self.queue.get()
+
+            if event == self.quit_object:
+                self.backend.close()
+                self.queue.task_done()
+                return
+
+            self.process_event(event)
+
+            self.queue.task_done()
+
+    def process_event(self, event):
+        """ Saves an event and the state it carries to the database. """
+        start = time.time()
+        now = datetime.now()
+
+        if self.keep_days is not None and self._last_purge != now.date():
+            self._last_purge = now.date()
+            self.backend.purge(self.keep_days)
+
+        if event.event_type == EVENT_STATE_CHANGED:
+            self.backend.record_state(
+                event.data['entity_id'], event.data.get('new_state'), now)
+
+        self.backend.record_event(event, now)
+
+        write_time = time.time() - start
+
+        self._events_recorded += 1
+        self._write_time += write_time
+        self._write_time_max = max(self._write_time_max, write_time)
+
+    def event_listener(self, event):
+        """ Listens for new events on the EventBus and puts them
+            in the process queue. """
+        if event.event_type == EVENT_TIME_CHANGED:
+            return
+
+        elif self.overflow == OVERFLOW_BLOCK:
+            self.queue.put(event)
+
+        elif self.overflow == OVERFLOW_DROP_OLDEST:
+            while True:
+                try:
+                    self.queue.put_nowait(event)
+                    return
+                except queue.Full:
+                    self._drop_oldest()
+
+        else:
+            with self._spill_lock:
+                if not self._spilling:
+                    try:
+                        self.queue.put_nowait(event)
+                        return
+                    except queue.Full:
+                        _LOGGER.warning(
+                            "Recorder queue full, spilling events to disk")
+                        self._spilling = True
+
+                self._spill(event)
+
+    def shutdown(self, event):
+        """ Tells the recorder to shut down. """
+        self.queue.put(self.quit_object)
+
+    def metrics(self):
+        """ Returns health metrics of the recorder. """
+        uptime = (datetime.now() - self.recording_start).total_seconds()
+        recorded = self._events_recorded
+        write_time = self._write_time
+
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'spilling': self._spilling,
+            'events_recorded': recorded,
+            'events_dropped': self._events_dropped,
+            'events_spilled': self._events_spilled,
+            'write_latency_avg': write_time / recorded if recorded else 0,
+            'write_latency_max': self._write_time_max,
+            'commits_per_second': recorded / uptime if uptime else 0,
+        }
+
+    def _drop_oldest(self):
+        """ Drops the oldest event in the queue to make room. """
+        try:
+            event = self.queue.get_nowait()
+        except queue.Empty:
+            return
+
+        self.queue.task_done()
+
+        if event == self.quit_object:
+            # Never drop the request to shut down
+            self.queue.put(event)
+            return
+
+        self._events_dropped += 1
+
+        if self._events_dropped % 1000 == 1:
+            _LOGGER.warning(
+                "Recorder queue full, %d events dropped so far",
+                self._events_dropped)
+
+    def _spill(self, event):
+        """ Appends an event to the spill file. Expects the spill lock. """
+        try:
+            with open(self._spill_path, 'a') as spill_file:
+                spill_file.write(json.dumps(event, cls=JSONEncoder))
+                spill_file.write('\n')
+
+            self._events_spilled += 1
+
+        except IOError:
+            _LOGGER.exception("Unable to spill event %s", event)
+            self._events_dropped += 1
+
+    def _replay_spill(self):
+        """ Records the events from the spill file in order. New events keep
+            being spilled until the spill file is empty. """
+        while True:
+            # A replay file is left behind if we got interrupted
+            if not os.path.isfile(self._replay_path):
+                with self._spill_lock:
+                    if not os.path.isfile(self._spill_path):
+                        self._spilling = False
+                        return
+
+                    os.replace(self._spill_path, self._replay_path)
+
+            with open(self._replay_path) as replay_file:
+                for line in replay_file:
+                    event = spill_line_to_event(line)
+
+                    if event is not None:
+                        self.process_event(event)
+
+            os.remove(self._replay_path)
+
+            # While spilling only a shut down request ends up in the queue.
+            # Leave the rest of the spill file for the next run.
+            if not self.queue.empty():
+                return
+
+    def block_till_done(self):
+        """ Blocks till all events processed. """
+        self.queue.join()
+
+        while self._spilling:
+            time.sleep(0.05)
+
+    def query(self, sql_query, data=None, return_value=None):
+        """ Query the database. """
+        return self.backend.query(sql_query, data, return_value)
+
+    def query_iter(self, sql_query, data=None, chunk_size=QUERY_CHUNK_SIZE):
+        """ Query the database and yield the rows. """
+        return self.backend.query_iter(sql_query, data, chunk_size)
+
+
+def _adapt_datetime(datetimestamp):
+    """ Turn a datetime into an integer for in the DB. """
+    return time.mktime(datetimestamp.timetuple())
+
+
+def _verify_instance():
+    """ throws error if recorder not initialized. """
+    if _INSTANCE is None:
+        raise RuntimeError("Recorder not initialized.")
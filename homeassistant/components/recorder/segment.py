@@ -0,0 +1,278 @@
+"""
+homeassistant.components.recorder.segment
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Stores the recorded events and states in append-only segment files, one file
+per day. Writes are sequential which is friendly to flash storage and
+expiring old data is done by removing whole segments.
+
+Every line in a segment is a JSON encoded record. Reads memory-map the
+segment and use an index per entity with the offsets of its states.
+"""
+import os
+import json
+import mmap
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from homeassistant import State
+from homeassistant.remote import JSONEncoder
+from homeassistant.components.recorder import StorageBackend, _adapt_datetime
+
+SEGMENT_DIR = 'home-assistant-segments'
+SEGMENT_EXT = '.log'
+SEGMENT_DATE_FORMAT = '%Y-%m-%d'
+
+RECORD_STATE = 'state'
+RECORD_EVENT = 'event'
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SegmentBackend(StorageBackend):
+    """ Stores events and states in append-only files, one per day. """
+
+    def __init__(self, hass, recording_start, config=None):
+        super().__init__(hass, recording_start, config)
+
+        self.path = hass.get_config_path(SEGMENT_DIR)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = None
+        # Per segment a dict that maps entity_id to the offsets of its states
+        self._indexes = {}
+
+    def setup(self):
+        """ Ensures the segment directory exists. """
+        os.makedirs(self.path, exist_ok=True)
+
+    def close(self):
+        """ Closes the open segment. """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._segment = None
+
+    def record_state(self, entity_id, state, now):
+        """ Appends a state to the segment of today. """
+        if state is None:
+            record = {
+                'type': RECORD_STATE,
+                'entity_id': entity_id,
+                'state': '',
+                'attributes': {},
+                'last_changed': _adapt_datetime(now),
+                'last_updated': _adapt_datetime(now),
+            }
+        else:
+            record = {
+                'type': RECORD_STATE,
+                'entity_id': entity_id.lower(),
+                'state': state.state,
+                'attributes': state.attributes,
+                'last_changed': _adapt_datetime(state.last_changed),
+                'last_updated': _adapt_datetime(state.last_updated),
+            }
+
+        self._append(record, now)
+
+    def record_event(self, event, now):
+        """ Appends an event to the segment of today. """
+        self._append({
+            'type': RECORD_EVENT,
+            'event_type': event.event_type,
+            'event_data': event.data,
+            'origin': str(event.origin),
+        }, now)
+
+    def read_states(self, start_time, end_time=None, entity_id=None):
+        """ Yields the states created during the period in order. """
+        start = _adapt_datetime(start_time)
+        end = _adapt_datetime(end_time) if end_time is not None else None
+
+        if entity_id is not None:
+            entity_id = entity_id.lower()
+
+        first_segment = _segment_name(start_time)
+        last_segment = _segment_name(end_time or datetime.now())
+
+        for segment in self._segments():
+            if not first_segment <= segment <= last_segment:
+                continue
+
+            for record in self._read_segment(segment, entity_id):
+                created = record['created']
+
+                if created < start or (end is not None and created >= end):
+                    continue
+
+                yield State(
+                    record['entity_id'], record['state'],
+                    record['attributes'],
+                    datetime.fromtimestamp(record['last_changed']))
+
+    def purge(self, keep_days):
+        """ Removes the segments older than keep_days. """
+        oldest_segment = _segment_name(
+            datetime.now() - timedelta(days=keep_days))
+
+        for segment in self._segments():
+            if segment >= oldest_segment:
+                continue
+
+            with self._lock:
+                if segment == self._segment:
+                    continue
+
+                self._indexes.pop(segment, None)
+
+                os.remove(os.path.join(self.path, segment))
+
+            _LOGGER.info("Removed segment %s", segment)
+
+    def _segments(self):
+        """ Returns the names of the segments in chronological order. """
+        return sorted(name for name in os.listdir(self.path)
+                      if name.endswith(SEGMENT_EXT))
+
+    def _append(self, record, now):
+        """ Appends a record to the segment for now. """
+        record['created'] = _adapt_datetime(now)
+
+        line = json.dumps(record, cls=JSONEncoder).encode('UTF-8') + b'\n'
+
+        segment = _segment_name(now)
+
+        with self._lock:
+            if segment != self._segment:
+                self._open_segment(segment)
+
+            offset = self._file.tell()
+
+            self._file.write(line)
+            # Make the record visible to readers of the segment
+            self._file.flush()
+
+            if record['type'] == RECORD_STATE:
+                self._indexes[segment].setdefault(
+                    record['entity_id'], []).append(offset)
+
+    def _open_segment(self, segment):
+        """ Closes the current segment and opens segment for appending.
+            Expects the lock. """
+        if self._file is not None:
+            self._file.close()
+
+        path = os.path.join(self.path, segment)
+
+        # Index the segment if we continue one, ie after a restart
+        if segment not in self._indexes:
+            self._indexes[segment] = _build_index(path)
+
+        self._file = open(path, 'ab')
+        self._segment = segment
+
+        # Terminate a partial record left behind by an interrupted write
+        if self._file.tell() > 0:
+            with open(path, 'rb') as segment_file:
+                segment_file.seek(-1, os.SEEK_END)
+
+                if segment_file.read(1) != b'\n':
+                    self._file.write(b'\n')
+
+    def _read_segment(self, segment, entity_id=None):
+        """ Yields the records of a segment. If entity_id is given, only the
+            states of that entity are read using the index. """
+        path = os.path.join(self.path, segment)
+
+        if entity_id is not None:
+            with self._lock:
+                if segment not in self._indexes:
+                    self._indexes[segment] = _build_index(path)
+
+                # Copy as the open segment keeps growing
+                offsets = list(self._indexes[segment].get(entity_id, ()))
+
+            if not offsets:
+                return
+
+        else:
+            offsets = None
+
+        with open(path, 'rb') as segment_file:
+            if os.fstat(segment_file.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(segment_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                for line in _read_lines(data, offsets):
+                    record = _decode_record(line, path)
+
+                    if record is not None and \
+                       record['type'] == RECORD_STATE:
+                        yield record
+
+
+def _segment_name(point_in_time):
+    """ Returns the name of the segment that covers point_in_time. """
+    return point_in_time.strftime(SEGMENT_DATE_FORMAT) + SEGMENT_EXT
+
+
+def _read_lines(data, offsets=None):
+    """ Yields lines from memory-mapped data, all or those at offsets. """
+    if offsets is None:
+        data.seek(0)
+
+        while True:
+            line = data.readline()
+
+            if not line:
+                return
+
+            yield line
+
+    for offset in offsets:
+        # The segment might have grown since it got mapped
+        if offset >= len(data):
+            return
+
+        data.seek(offset)
+
+        yield data.readline()
+
+
+def _decode_record(line, path):
+    """ Decodes a line of a segment. """
+    try:
+        return json.loads(line.decode('UTF-8'))
+    except ValueError:
+        # A partial line is left behind if we got killed during a write
+        _LOGGER.warning("Skipping invalid record in %s: %s", path, line)
+        return None
+
+
+def _build_index(path):
+    """ Returns the state offsets per entity of the segment at path. """
+    index = {}
+
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return index
+
+    with open(path, 'rb') as segment_file, \
+            mmap.mmap(segment_file.fileno(), 0,
+                      access=mmap.ACCESS_READ) as data:
+
+        offset = 0
+
+        for line in _read_lines(data):
+            record = _decode_record(line, path)
+
+            if record is not None and record['type'] == RECORD_STATE:
+                index.setdefault(record['entity_id'], []).append(offset)
+
+            offset += len(line)
+
+    return index
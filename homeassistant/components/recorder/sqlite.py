@@ -0,0 +1,434 @@
+"""
+homeassistant.components.recorder.sqlite
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Stores the recorded events and states in a SQLite database.
+"""
+import logging
+import threading
+import sqlite3
+from datetime import datetime, timedelta
+import json
+import math
+import atexit
+
+from homeassistant.remote import JSONEncoder
+from homeassistant.components.recorder import (
+    StorageBackend, LazyState, DB_FILE, QUERY_CHUNK_SIZE, STATISTICS_PERIODS,
+    RETURN_ROWCOUNT, RETURN_LASTROWID, RETURN_ONE_ROW, _adapt_datetime)
+
+# Interval between snapshots of the latest state of every entity
+SNAPSHOT_INTERVAL = timedelta(hours=1)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StatisticsBucket(object):
+    """ Accumulates numeric values of an entity during one period. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, start, row=None):
+        self.start = start
+
+        if row is None:
+            self.min = self.max = self.last = None
+            self.total = 0.0
+            self.count = 0
+        else:
+            self.min, self.max, mean, self.last, self.count = row
+            self.total = mean * self.count
+
+    @property
+    def mean(self):
+        """ Returns the mean of the values in this bucket. """
+        return self.total / self.count if self.count else None
+
+    def add(self, value):
+        """ Adds a value to this bucket. """
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+        self.total += value
+        self.count += 1
+
+
+class SQLiteBackend(StorageBackend):
+    """ Stores events and states in a SQLite database. """
+
+    supports_query = True
+
+    def __init__(self, hass, recording_start, config=None):
+        super().__init__(hass, recording_start, config)
+
+        self.conn = None
+        self.lock = threading.Lock()
+        # Open statistics buckets keyed by (entity_id, period)
+        self._statistics = {}
+        # Id and creation time of the last snapshot of this run
+        self._last_snapshot = (None, recording_start)
+
+    def setup(self):
+        """ Ensure database is ready to fly and log the start of the run. """
+        self._setup_connection()
+        self._setup_run()
+
+    def close(self):
+        """ Log the end of the run and close the database. """
+        self._close_run()
+        self._close_connection()
+
+    def record_state(self, entity_id, state, now):
+        """ Save a state to the database. """
+        if state is None:
+            info = (entity_id, '', "{}", now, now, now)
+        else:
+            info = (
+                entity_id.lower(), state.state, json.dumps(state.attributes),
+                state.last_changed, state.last_updated, now)
+
+        self.query(
+            "INSERT INTO states ("
+            "entity_id, state, attributes, last_changed, last_updated,"
+            "created) VALUES (?, ?, ?, ?, ?, ?)", info)
+
+        if state is not None:
+            self.record_statistics(state)
+
+        if now - self._last_snapshot[1] >= SNAPSHOT_INTERVAL:
+            self.write_snapshot(now)
+
+    def write_snapshot(self, now):
+        """ Stores the id of the latest state of every entity so that the
+            states at a point in time can be found without going through
+            all the states of the run. """
+        last_id, last_created = self._last_snapshot
+
+        # A snapshot is the previous snapshot updated with the states that
+        # were created since.
+        with self.conn, self.lock:
+            cur = self.conn.cursor()
+
+            cur.execute(
+                "INSERT INTO snapshots (created) VALUES (?)", (now,))
+
+            snapshot_id = cur.lastrowid
+
+            cur.execute("""
+                INSERT INTO snapshot_states (snapshot_id, entity_id, state_id)
+                SELECT ?, entity_id, max(state_id) FROM (
+                    SELECT entity_id, state_id FROM snapshot_states
+                    WHERE snapshot_id = ?
+                    UNION ALL
+                    SELECT entity_id, state_id FROM states
+                    WHERE created >= ? AND created < ?)
+                GROUP BY entity_id
+            """, (snapshot_id, last_id, last_created, now))
+
+        self._last_snapshot = (snapshot_id, now)
+
+    def record_statistics(self, state):
+        """ Update the statistics rollups if state is numeric. """
+        try:
+            value = float(state.state)
+        except ValueError:
+            return
+
+        if not math.isfinite(value):
+            return
+
+        timestamp = _adapt_datetime(state.last_updated)
+
+        for period, seconds in STATISTICS_PERIODS.items():
+            start = int(timestamp - timestamp % seconds)
+            key = (state.entity_id, period)
+
+            bucket = self._statistics.get(key)
+
+            if bucket is None or bucket.start != start:
+                bucket = self._load_statistics_bucket(
+                    state.entity_id, period, start)
+                self._statistics[key] = bucket
+
+            bucket.add(value)
+
+            self.query(
+                "INSERT OR REPLACE INTO statistics ("
+                "entity_id, period, start, min, max, mean, last, count"
+                ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (state.entity_id, period, start, bucket.min, bucket.max,
+                 bucket.mean, bucket.last, bucket.count))
+
+    def _load_statistics_bucket(self, entity_id, period, start):
+        """ Returns the bucket for start, continuing a stored one if the
+            bucket was already started before a restart. """
+        row = self.query(
+            "SELECT min, max, mean, last, count FROM statistics "
+            "WHERE entity_id=? AND period=? AND start=?",
+            (entity_id, period, start), return_value=RETURN_ONE_ROW)
+
+        return StatisticsBucket(start, row)
+
+    def record_event(self, event, now):
+        """ Save an event to the database. """
+        info = (
+            event.event_type, json.dumps(event.data, cls=JSONEncoder),
+            str(event.origin), now
+        )
+
+        self.query(
+            "INSERT INTO events ("
+            "event_type, event_data, origin, created"
+            ") VALUES (?, ?, ?, ?)", info)
+
+    def read_states(self, start_time, end_time=None, entity_id=None):
+        """ Yields the recorded states created during the period. """
+        where = "created >= ? "
+        data = [start_time]
+
+        if end_time is not None:
+            where += "AND created < ? "
+            data.append(end_time)
+
+        if entity_id is not None:
+            where += "AND entity_id = ? "
+            data.append(entity_id.lower())
+
+        for row in self.query_iter(
+                "SELECT * FROM states WHERE {} "
+                "ORDER BY state_id".format(where), data):
+            yield LazyState(
+                row[1], row[2], row[3], datetime.fromtimestamp(row[4]))
+
+    def purge(self, keep_days):
+        """ Removes events and states older than keep_days. """
+        purge_before = datetime.now() - timedelta(days=keep_days)
+
+        deleted = self.query(
+            "DELETE FROM states WHERE created < ?", (purge_before,),
+            return_value=RETURN_ROWCOUNT)
+        deleted += self.query(
+            "DELETE FROM events WHERE created < ?", (purge_before,),
+            return_value=RETURN_ROWCOUNT)
+
+        self.query(
+            "DELETE FROM snapshot_states WHERE snapshot_id IN ("
+            "SELECT snapshot_id FROM snapshots WHERE created < ?)",
+            (purge_before,))
+        self.query(
+            "DELETE FROM snapshots WHERE created < ?", (purge_before,))
+
+        if deleted:
+            _LOGGER.info("Purged %d rows older than %s", deleted, purge_before)
+
+    def query(self, sql_query, data=None, return_value=None):
+        """ Query the database. """
+        try:
+            with self.conn, self.lock:
+                _LOGGER.info("Running query %s", sql_query)
+
+                cur = self.conn.cursor()
+
+                if data is not None:
+                    cur.execute(sql_query, data)
+                else:
+                    cur.execute(sql_query)
+
+                if return_value == RETURN_ROWCOUNT:
+                    return cur.rowcount
+                elif return_value == RETURN_LASTROWID:
+                    return cur.lastrowid
+                elif return_value == RETURN_ONE_ROW:
+                    return cur.fetchone()
+                else:
+                    return cur.fetchall()
+
+        except sqlite3.IntegrityError:
+            _LOGGER.exception(
+                "Error querying the database using: %s", sql_query)
+            return []
+
+    def query_iter(self, sql_query, data=None, chunk_size=QUERY_CHUNK_SIZE):
+        """ Query the database on a separate read connection and yield the
+            rows in chunks so the result set is never fully in memory. """
+        conn = sqlite3.connect(
+            self.hass.get_config_path(DB_FILE), check_same_thread=False)
+
+        try:
+            _LOGGER.info("Running streaming query %s", sql_query)
+
+            cur = conn.cursor()
+
+            if data is not None:
+                cur.execute(sql_query, data)
+            else:
+                cur.execute(sql_query)
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+
+                if not rows:
+                    return
+
+                yield from rows
+
+        finally:
+            conn.close()
+
+    def _setup_connection(self):
+        """ Ensure database is ready to fly. """
+        db_path = self.hass.get_config_path(DB_FILE)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+        # Make sure the database is closed whenever Python exits
+        # without the STOP event being fired.
+        atexit.register(self._close_connection)
+
+        # Have datetime objects be saved as integers
+        sqlite3.register_adapter(datetime, _adapt_datetime)
+
+        # Write-ahead logging allows the read connections of streaming
+        # queries to run without blocking the recorder.
+        self.conn.execute('PRAGMA journal_mode=WAL')
+
+        # Validate we are on the correct schema or that we have to migrate
+        cur = self.conn.cursor()
+
+        def save_migration(migration_id):
+            """ Save and commit a migration to the database. """
+            cur.execute('INSERT INTO schema_version VALUES (?, ?)',
+                        (migration_id, datetime.now()))
+            self.conn.commit()
+            _LOGGER.info("Database migrated to version %d", migration_id)
+
+        try:
+            cur.execute('SELECT max(migration_id) FROM schema_version;')
+            migration_id = cur.fetchone()[0] or 0
+
+        except sqlite3.OperationalError:
+            # The table does not exist
+            cur.execute('CREATE TABLE schema_version ('
+                        'migration_id integer primary key, performed integer)')
+            migration_id = 0
+
+        if migration_id < 1:
+            cur.execute("""
+                CREATE TABLE recorder_runs (
+                    run_id integer primary key,
+                    start integer,
+                    end integer,
+                    closed_incorrect integer default 0,
+                    created integer)
+            """)
+
+            cur.execute("""
+                CREATE TABLE events (
+                    event_id integer primary key,
+                    event_type text,
+                    event_data text,
+                    origin text,
+                    created integer)
+            """)
+            cur.execute(
+                'CREATE INDEX events__event_type ON events(event_type)')
+
+            cur.execute("""
+                CREATE TABLE states (
+                    state_id integer primary key,
+                    entity_id text,
+                    state text,
+                    attributes text,
+                    last_changed integer,
+                    last_updated integer,
+                    created integer)
+            """)
+            cur.execute('CREATE INDEX states__entity_id ON states(entity_id)')
+
+            save_migration(1)
+
+        if migration_id < 2:
+            # Composite indexes that match the queries of the history
+            # component. states__significant_changes makes the single
+            # column index on entity_id redundant.
+            cur.execute('DROP INDEX IF EXISTS states__entity_id')
+
+            cur.execute("""
+                CREATE INDEX states__significant_changes
+                ON states(entity_id, last_changed)
+            """)
+            cur.execute("""
+                CREATE INDEX states__state_changes
+                ON states(last_changed, last_updated, entity_id)
+            """)
+            cur.execute(
+                'CREATE INDEX states__created ON states(created, entity_id)')
+
+            save_migration(2)
+
+        if migration_id < 3:
+            cur.execute("""
+                CREATE TABLE statistics (
+                    statistic_id integer primary key,
+                    entity_id text,
+                    period text,
+                    start integer,
+                    min real,
+                    max real,
+                    mean real,
+                    last real,
+                    count integer)
+            """)
+            cur.execute("""
+                CREATE UNIQUE INDEX statistics__entity_period_start
+                ON statistics(entity_id, period, start)
+            """)
+            cur.execute(
+                'CREATE INDEX statistics__period ON statistics(period, start)')
+
+            save_migration(3)
+
+        if migration_id < 4:
+            cur.execute("""
+                CREATE TABLE snapshots (
+                    snapshot_id integer primary key,
+                    created integer)
+            """)
+            cur.execute(
+                'CREATE INDEX snapshots__created ON snapshots(created)')
+
+            cur.execute("""
+                CREATE TABLE snapshot_states (
+                    snapshot_id integer,
+                    entity_id text,
+                    state_id integer)
+            """)
+            cur.execute("""
+                CREATE INDEX snapshot_states__snapshot_id
+                ON snapshot_states(snapshot_id, entity_id)
+            """)
+
+            save_migration(4)
+
+    def _close_connection(self):
+        """ Close connection to the database. """
+        _LOGGER.info("Closing database")
+        atexit.unregister(self._close_connection)
+        self.conn.close()
+
+    def _setup_run(self):
+        """ Log the start of the current run. """
+        if self.query("""UPDATE recorder_runs SET end=?, closed_incorrect=1
+                      WHERE end IS NULL""", (self.recording_start, ),
+                      return_value=RETURN_ROWCOUNT):
+
+            _LOGGER.warning("Found unfinished sessions")
+
+        self.query(
+            "INSERT INTO recorder_runs (start, created) VALUES (?, ?)",
+            (self.recording_start, datetime.now()))
+
+    def _close_run(self):
+        """ Save end time for current run. """
+        self.query(
+            "UPDATE recorder_runs SET end=? WHERE start=?",
+            (datetime.now(), self.recording_start))
@@ -116,6 +116,7 @@ URL_API_COMPONENTS = "/api/components"
 HTTP_OK = 200
 HTTP_CREATED = 201
 HTTP_MOVED_PERMANENTLY = 301
+HTTP_NOT_MODIFIED = 304
 HTTP_BAD_REQUEST = 400
 HTTP_UNAUTHORIZED = 401
 HTTP_NOT_FOUND = 404
@@ -123,6 +124,7 @@ HTTP_METHOD_NOT_ALLOWED = 405
 HTTP_UNPROCESSABLE_ENTITY = 422
 
 HTTP_HEADER_HA_AUTH = "X-HA-access"
+HTTP_HEADER_HA_HISTORY_CURSOR = "X-HA-History-Cursor"
 HTTP_HEADER_ACCEPT_ENCODING = "Accept-Encoding"
 HTTP_HEADER_CONTENT_TYPE = "Content-type"
 HTTP_HEADER_CONTENT_ENCODING = "Content-Encoding"
@@ -130,5 +132,9 @@ HTTP_HEADER_VARY = "Vary"
 HTTP_HEADER_CONTENT_LENGTH = "Content-Length"
 HTTP_HEADER_CACHE_CONTROL = "Cache-Control"
 HTTP_HEADER_EXPIRES = "Expires"
+HTTP_HEADER_CONNECTION = "Connection"
+HTTP_HEADER_TRANSFER_ENCODING = "Transfer-Encoding"
+HTTP_HEADER_ETAG = "ETag"
+HTTP_HEADER_IF_NONE_MATCH = "If-None-Match"
 
 CONTENT_TYPE_JSON = "application/json"
@@ -251,10 +251,12 @@ class StateMachine(ha.StateMachine):
         """ Discards current data and mirrors the remote state machine. """
         self._states = {state.entity_id: state for state
                         in get_states(self._api)}
+        self.version += 1
 
     def _state_changed_listener(self, event):
         """ Listens for state changed events and applies them. """
         self._states[event.data['entity_id']] = event.data['new_state']
+        self.version += 1
 
 
 class JSONEncoder(json.JSONEncoder):
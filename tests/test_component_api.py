@@ -5,8 +5,12 @@ tests.test_component_http
 Tests Home Assistant HTTP component does what it should do.
 """
 # pylint: disable=protected-access,too-many-public-methods
+import re
+import gzip
 import unittest
 import json
+from http.client import HTTPConnection
+from unittest.mock import patch
 
 import requests
 
@@ -14,7 +18,8 @@ import homeassistant as ha
 import homeassistant.bootstrap as bootstrap
 import homeassistant.remote as remote
 import homeassistant.components.http as http
-from homeassistant.const import HTTP_HEADER_HA_AUTH
+import homeassistant.components.api as api
+from homeassistant.const import HTTP_HEADER_HA_AUTH, URL_API_STREAM
 
 API_PASSWORD = "test1234"
 
@@ -151,6 +156,139 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(400, req.status_code)
 
     # pylint: disable=invalid-name
+    def test_keep_alive(self):
+        """ Test requests can share a connection. """
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT)
+
+        conn.request('GET', remote.URL_API_STATES, headers=HA_HEADERS)
+        resp = conn.getresponse()
+        self.assertEqual(200, resp.status)
+        self.assertEqual(
+            len(resp.read()), int(resp.getheader('Content-Length')))
+
+        sock = conn.sock
+
+        conn.request('GET', '/api/not_existing', headers=HA_HEADERS)
+        resp = conn.getresponse()
+        resp.read()
+        self.assertEqual(404, resp.status)
+
+        conn.request('GET', remote.URL_API, headers=HA_HEADERS)
+        resp = conn.getresponse()
+        resp.read()
+        self.assertEqual(200, resp.status)
+
+        self.assertIs(sock, conn.sock)
+        conn.close()
+
+    def test_keep_alive_max_requests(self):
+        """ Test the connection is closed after the maximum requests. """
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT)
+
+        with patch.object(http.RequestHandler, 'max_requests', 2):
+            conn.request('GET', remote.URL_API, headers=HA_HEADERS)
+            resp = conn.getresponse()
+            resp.read()
+            self.assertIsNone(resp.getheader('Connection'))
+
+            conn.request('GET', remote.URL_API, headers=HA_HEADERS)
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual('close', resp.getheader('Connection'))
+
+        conn.close()
+
+    def test_compact_json(self):
+        """ Test JSON is compact unless pretty output is asked for. """
+        req = requests.get(_url(remote.URL_API), headers=HA_HEADERS)
+
+        self.assertEqual('{"message":"API running."}', req.text)
+
+        req = requests.get(
+            _url(remote.URL_API), params={'pretty': 1}, headers=HA_HEADERS)
+
+        self.assertIn('\n    "message": "API running."', req.text)
+
+    def test_compressed_json(self):
+        """ Test large responses get compressed if the client accepts it. """
+        hass.states.set('test.large', 'on', {'data': 'a' * 2000})
+
+        conn = HTTPConnection('127.0.0.1', SERVER_PORT)
+
+        headers = {'Accept-Encoding': 'deflate;q=0.5, gzip'}
+        headers.update(HA_HEADERS)
+
+        conn.request('GET', remote.URL_API_STATES_ENTITY.format('test.large'),
+                     headers=headers)
+        resp = conn.getresponse()
+
+        self.assertEqual('gzip', resp.getheader('Content-Encoding'))
+        self.assertEqual(
+            'on', json.loads(gzip.decompress(resp.read()).decode())['state'])
+
+        headers['Accept-Encoding'] = 'gzip;q=0'
+
+        conn.request('GET', remote.URL_API_STATES_ENTITY.format('test.large'),
+                     headers=headers)
+        resp = conn.getresponse()
+
+        self.assertIsNone(resp.getheader('Content-Encoding'))
+        self.assertEqual('on', json.loads(resp.read().decode())['state'])
+
+        conn.close()
+
+    def test_api_states_not_modified(self):
+        """ Test polling states gives 304 when nothing changed. """
+        req = requests.get(_url(remote.URL_API_STATES), headers=HA_HEADERS)
+        etag = req.headers['ETag']
+
+        headers = {'If-None-Match': etag}
+        headers.update(HA_HEADERS)
+
+        req = requests.get(_url(remote.URL_API_STATES), headers=headers)
+
+        self.assertEqual(304, req.status_code)
+        self.assertEqual(b'', req.content)
+
+        hass.states.set('test.etag', 'changed')
+
+        req = requests.get(_url(remote.URL_API_STATES), headers=headers)
+
+        self.assertEqual(200, req.status_code)
+        self.assertNotEqual(etag, req.headers['ETag'])
+
+    def test_api_stream(self):
+        """ Test events are forwarded to the event stream. """
+        req = requests.get(_url(URL_API_STREAM), headers=HA_HEADERS,
+                           stream=True)
+        lines = req.iter_lines()
+
+        self.assertEqual(b'data: ping', next(lines))
+
+        hass.bus.fire('test_stream_event', {'hello': 'world'})
+
+        message = next(line for line in lines if line)
+        req.close()
+
+        event = json.loads(message[len('data: '):].decode())
+        self.assertEqual('test_stream_event', event['event_type'])
+        self.assertEqual({'hello': 'world'}, event['data'])
+
+    def test_api_stream_slow_client(self):
+        """ Test stream clients that fall behind get disconnected. """
+        broadcaster = api.StreamBroadcaster(hass)
+
+        with patch.object(api, 'STREAM_QUEUE_SIZE', 2):
+            client = api.StreamClient()
+
+        broadcaster._clients.append(client)
+
+        for _ in range(3):
+            hass.bus.fire('test_stream_event')
+            hass.pool.block_till_done()
+
+        self.assertEqual(api.CLOSE_REASON_SLOW, client.close_reason)
+
     def test_api_fire_event_with_no_data(self):
         """ Test if the API allows us to fire an event. """
         test_value = []
@@ -364,3 +502,53 @@ class TestAPI(unittest.TestCase):
                 }),
             headers=HA_HEADERS)
         self.assertEqual(200, req.status_code)
+
+
+class TestRouteTable(unittest.TestCase):
+    """ Test the route table of the HTTP server. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """ Init needed objects. """
+        self.routes = http.RouteTable()
+        self.routes.add('GET', '/api/states', 'states')
+        self.routes.add(
+            'GET', re.compile(r'/api/states/(?P<entity_id>[a-zA-Z\._0-9]+)'),
+            'state')
+        self.routes.add(
+            'GET', re.compile(r'/files/(?P<file>[a-z/]+)/raw'), 'raw', False)
+        self.routes.add('GET', re.compile(r'/numbers/(?P<nr>\d+)'), 'nr')
+
+    def test_exact_string_route(self):
+        """ Test string routes have to match the whole path. """
+        self.assertEqual(
+            (200, ('states', True)),
+            self.routes.lookup('GET', '/api/states')[:2])
+        self.assertEqual(
+            404, self.routes.lookup('GET', '/api/states_all')[0])
+
+    def test_typed_parameters(self):
+        """ Test parameters are matched like the regular expression. """
+        status, route, path_match = self.routes.lookup(
+            'GET', '/api/states/light.kitchen')
+
+        self.assertEqual((200, ('state', True)), (status, route))
+        self.assertEqual('light.kitchen', path_match.group('entity_id'))
+
+        status, route, path_match = self.routes.lookup(
+            'GET', '/files/a/b/raw')
+
+        self.assertEqual((200, ('raw', False)), (status, route))
+        self.assertEqual('a/b', path_match.group('file'))
+
+    def test_regex_fallback(self):
+        """ Test expressions that do not fit the tree still match. """
+        status, route, path_match = self.routes.lookup('GET', '/numbers/12')
+
+        self.assertEqual((200, 'nr'), (status, route[0]))
+        self.assertEqual('12', path_match.group('nr'))
+
+    def test_method_not_allowed(self):
+        """ Test a matching path with another method gives 405. """
+        self.assertEqual(
+            405, self.routes.lookup('POST', '/api/states/light.kitchen')[0])
+        self.assertEqual(404, self.routes.lookup('POST', '/unknown')[0])
@@ -78,6 +78,24 @@ class TestFrontend(unittest.TestCase):
 
         self.assertEqual(200, req.status_code)
 
+    def test_static_file_cache(self):
+        """ Tests static files are compressed once and sent uncompressed. """
+        req = requests.get(
+            _url("/static/favicon.ico"), headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual('gzip', req.headers['Content-Encoding'])
+        self.assertTrue(any(path.endswith('favicon.ico')
+                            for path in hass.http.file_cache._files))
+
+        plain = requests.get(
+            _url("/static/favicon.ico"),
+            headers={'Accept-Encoding': 'identity'})
+
+        self.assertEqual(200, plain.status_code)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(req.content, plain.content)
+
     def test_auto_filling_in_api_password(self):
         req = requests.get(
             _url("?{}={}".format(http.DATA_API_PASSWORD, API_PASSWORD)))
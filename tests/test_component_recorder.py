@@ -0,0 +1,495 @@
+"""
+tests.test_component_recorder
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests the recorder and the queries the history component runs on top of it.
+"""
+# pylint: disable=protected-access,too-many-public-methods
+import os
+import unittest
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import homeassistant as ha
+import homeassistant.bootstrap as bootstrap
+import homeassistant.components.recorder as recorder
+import homeassistant.components.recorder.segment as segment
+import homeassistant.components.history as history
+
+
+def _setup_recorder(config=None, start=True):
+    """ Returns Home Assistant with a recorder in a tmp dir. """
+    hass = ha.HomeAssistant()
+    hass.config_dir = tempfile.mkdtemp()
+
+    bootstrap.setup_component(hass, recorder.DOMAIN, config)
+
+    if start:
+        _start_recorder(hass)
+
+    return hass
+
+
+def _start_recorder(hass):
+    """ Starts Home Assistant and waits till the recorder caught up. """
+    hass.start()
+    hass.pool.block_till_done()
+    recorder._INSTANCE.block_till_done()
+
+
+def _stop_recorder(hass):
+    """ Stops Home Assistant and removes the tmp dir. """
+    hass.stop()
+
+    if recorder._INSTANCE.is_alive():
+        recorder._INSTANCE.join()
+
+    shutil.rmtree(hass.config_dir)
+
+
+class TestRecorder(unittest.TestCase):
+    """ Test the recorder module. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """ Init needed objects. """
+        self.hass = _setup_recorder()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop down stuff we started. """
+        _stop_recorder(self.hass)
+
+    def _record(self):
+        """ Wait till all pending states and events are recorded. """
+        self.hass.pool.block_till_done()
+        recorder._INSTANCE.block_till_done()
+
+    def test_saving_state(self):
+        """ Tests saving and restoring a state. """
+        self.hass.states.set('test.recorder', 'on', {'test_attr': 5})
+
+        self._record()
+
+        states = recorder.query_states('SELECT * FROM states')
+
+        self.assertEqual(1, len(states))
+        self.assertEqual(self.hass.states.get('test.recorder'), states[0])
+
+    def test_streaming_states(self):
+        """ Tests streaming states in chunks with lazy attributes. """
+        for idx in range(5):
+            self.hass.states.set('test.recorder', idx, {'idx': idx})
+            self.hass.pool.block_till_done()
+
+        self._record()
+
+        rows = list(recorder.query_iter(
+            'SELECT * FROM states ORDER BY state_id', chunk_size=2))
+
+        self.assertEqual(5, len(rows))
+
+        states = list(recorder.query_states_iter(
+            'SELECT * FROM states ORDER BY state_id'))
+
+        self.assertIsNone(states[0]._attributes)
+        self.assertEqual({'idx': 0}, states[0].attributes)
+        self.assertEqual(self.hass.states.get('test.recorder'), states[-1])
+
+    def test_schema_migrated(self):
+        """ Tests that the database is at the latest schema version. """
+        row = recorder.query(
+            'SELECT max(migration_id) FROM schema_version')[0]
+
+        self.assertEqual(4, row[0])
+
+    def test_get_states_from_snapshot(self):
+        """ Tests states at a point in time are the same with snapshots. """
+        for idx in range(3):
+            self.hass.states.set('test.one', idx)
+            self.hass.states.set('test.two', idx)
+            self.hass.pool.block_till_done()
+
+        self._record()
+
+        snapshot_time = datetime.now()
+
+        expected = history.get_states(snapshot_time)
+
+        recorder._INSTANCE.backend.write_snapshot(snapshot_time)
+
+        self.assertEqual(
+            sorted(expected, key=lambda state: state.entity_id),
+            sorted(history.get_states(snapshot_time),
+                   key=lambda state: state.entity_id))
+
+        self.hass.states.set('test.two', 'changed')
+        self.hass.states.set('test.three', 'new')
+        self.hass.pool.block_till_done()
+        self._record()
+
+        states = history.get_states(
+            datetime.now() + timedelta(seconds=1),
+            ['test.one', 'test.two', 'test.three'])
+
+        self.assertEqual(
+            [self.hass.states.get(entity_id) for entity_id
+             in ('test.one', 'test.three', 'test.two')],
+            sorted(states, key=lambda state: state.entity_id))
+
+    def test_statistics_rollup(self):
+        """ Tests that numeric states are rolled up. """
+        for value in (5, 1, 'unknown', 3):
+            self.hass.states.set('sensor.temperature', value)
+            self.hass.pool.block_till_done()
+
+        self.hass.states.set('test.not_numeric', 'on')
+
+        self._record()
+
+        stats = history.statistics_during_period(
+            datetime.now() - timedelta(hours=2))
+
+        self.assertEqual(['sensor.temperature'], list(stats))
+
+        statistic = stats['sensor.temperature'][-1]
+
+        self.assertEqual(recorder.STATISTICS_HOUR, statistic['period'])
+        self.assertEqual(1, statistic['min'])
+        self.assertEqual(5, statistic['max'])
+        self.assertEqual(3, statistic['mean'])
+        self.assertEqual(3, statistic['last'])
+        self.assertEqual(3, statistic['count'])
+
+    def test_state_changes_filtered(self):
+        """ Tests filtering state changes on entity ids and domains. """
+        for idx in range(2):
+            for entity_id in ('test.one', 'test.two', 'sensor.three',
+                              'sensor_other.four'):
+                self.hass.states.set(entity_id, idx)
+            self.hass.pool.block_till_done()
+
+        self._record()
+
+        start = datetime.now() - timedelta(seconds=5)
+
+        history_iter = history.state_changes_during_period_iter(
+            start, entity_ids=['test.one'], domains=['sensor'])
+
+        self.assertEqual(
+            [('sensor.three', ['0', '1']), ('test.one', ['0', '1'])],
+            [(entity_id, [state.state for state in states])
+             for entity_id, states in history_iter])
+
+        self.assertEqual(
+            ['sensor.three', 'sensor_other.four', 'test.one', 'test.two'],
+            list(history.state_changes_during_period(start)))
+
+        self.assertEqual(
+            {}, history.state_changes_during_period(
+                start, start + timedelta(seconds=1), 'test.one'))
+
+    def test_history_cache(self):
+        """ Tests recent history is answered from the cache. """
+        cache = history.HistoryCache(self.hass, 4, timedelta(hours=1))
+
+        # No states existed yet so the cache is complete since before
+        start = (datetime.now() - timedelta(seconds=5)).replace(microsecond=0)
+        cache.since = start
+
+        for idx in range(3):
+            self.hass.states.set('test.one', idx)
+            self.hass.states.set('test.two', idx)
+            self.hass.pool.block_till_done()
+
+        self.hass.states.set('test.one', 2, {'attr': 1})
+        self._record()
+
+        with patch.object(history, '_CACHE', cache):
+            cached = list(history.state_changes_during_period_iter(start))
+            cached_one = list(history.state_changes_during_period_iter(
+                start, entity_ids=['test.one']))
+
+        self.assertEqual(['test.one', 'test.two'],
+                         [entity_id for entity_id, _ in cached])
+        self.assertEqual(
+            list(history.state_changes_during_period_iter(start)), cached)
+        self.assertEqual(
+            list(history.state_changes_during_period_iter(
+                start, entity_ids=['test.one'])), cached_one)
+
+        self.assertIsNone(cache.last_5_states('test.one'))
+
+        # Evicting the oldest state makes older periods come from SQL
+        self.hass.states.set('test.one', 3)
+        self.hass.pool.block_till_done()
+
+        self.assertIsNone(cache.state_changes(
+            start, datetime.now(), ['test.one'], []))
+        self.assertIsNotNone(cache.state_changes(
+            start, datetime.now(), ['test.two'], []))
+        self.assertIsNone(cache.state_changes(
+            start, datetime.now(), [], []))
+
+    def test_state_changes_since_cursor(self):
+        """ Tests fetching only the state changes after a cursor. """
+        self.hass.states.set('test.one', 'first')
+        self._record()
+
+        cursor = history.latest_cursor()
+
+        self.hass.states.set('test.one', 'second')
+        self.hass.states.set('test.two', 'first')
+        self._record()
+
+        end_cursor = history.latest_cursor()
+
+        self.hass.states.set('test.one', 'third')
+        self._record()
+
+        self.assertEqual(
+            [('test.one', ['second']), ('test.two', ['first'])],
+            [(entity_id, [state.state for state in states])
+             for entity_id, states in history.state_changes_since_cursor(
+                 cursor, end_cursor)])
+
+        self.assertEqual(
+            [('test.one', ['second', 'third'])],
+            [(entity_id, [state.state for state in states])
+             for entity_id, states in history.state_changes_since_cursor(
+                 cursor, entity_ids=['test.one'])])
+
+    def test_history_queries_use_indexes(self):
+        """ Tests that no history query does a full table scan. """
+        for idx in range(20):
+            for entity_id in ('test.one', 'test.two', 'sensor.three'):
+                self.hass.states.set(entity_id, idx)
+
+        self._record()
+
+        now = datetime.now()
+        point_in_time = now - timedelta(seconds=5)
+
+        queries = []
+        original_query = recorder.query
+        original_query_iter = recorder.query_iter
+
+        def capture_query(sql_query, arguments=None, return_value=None):
+            """ Store the query before running it. """
+            queries.append((sql_query, arguments))
+            return original_query(sql_query, arguments, return_value)
+
+        def capture_query_iter(sql_query, arguments=None,
+                               chunk_size=recorder.QUERY_CHUNK_SIZE):
+            """ Store the streamed query before running it. """
+            queries.append((sql_query, arguments))
+            return original_query_iter(sql_query, arguments, chunk_size)
+
+        with patch.object(recorder, 'query', capture_query), \
+                patch.object(recorder, 'query_iter', capture_query_iter):
+            history.last_5_states('test.one')
+            history.state_changes_during_period(point_in_time)
+            history.state_changes_during_period(point_in_time, now)
+            history.state_changes_during_period(
+                point_in_time, entity_id='test.one')
+            history.state_changes_during_period(
+                point_in_time, entity_ids=['test.one'], domains=['sensor'])
+            history.latest_cursor()
+            list(history.state_changes_since_cursor(10, 20, ['test.one']))
+            history.get_states(now, ['test.one', 'test.two'])
+            recorder._INSTANCE.backend.write_snapshot(now)
+            history.get_states(now, ['test.one', 'test.two'])
+            history.get_states(now)
+            recorder.run_information().entity_ids(now)
+            history.statistics_during_period(point_in_time)
+
+        self.assertTrue(queries)
+
+        for sql_query, arguments in queries:
+            plan = [row[3] for row in original_query(
+                'EXPLAIN QUERY PLAN ' + sql_query, arguments)]
+
+            for step in plan:
+                # Scanning a materialized subquery is fine, scanning a table
+                # or a whole index is not.
+                self.assertFalse(
+                    step.startswith('SCAN') and 'subquery' not in step,
+                    "Full scan in {}: {}".format(sql_query, plan))
+
+
+class TestHistoryDownsample(unittest.TestCase):
+    """ Test downsampling history for the history API. """
+
+    @staticmethod
+    def _states(values):
+        """ Returns states with values one minute apart. """
+        start = datetime(2015, 1, 1)
+
+        return [ha.State('sensor.test', value,
+                         last_changed=start + timedelta(minutes=idx))
+                for idx, value in enumerate(values)]
+
+    def test_numeric_keeps_peaks(self):
+        """ Test LTTB keeps first, last and extreme values. """
+        values = ['0'] * 50 + ['100'] + ['0'] * 48 + ['5']
+        states = self._states(values)
+
+        result = history.downsample(states, 10)
+
+        self.assertEqual(10, len(result))
+        self.assertIs(states[0], result[0])
+        self.assertIs(states[-1], result[-1])
+        self.assertIn('100', [state.state for state in result])
+
+    def test_discrete_keeps_longest_changes(self):
+        """ Test discrete states keep the changes that lasted longest. """
+        states = self._states(
+            ['off', 'on', 'off', 'off', 'off', 'on', 'off', 'on'])
+
+        self.assertEqual(
+            ['off', 'on', 'off', 'on', 'off', 'on'],
+            [state.state for state in history.downsample(states, 6)])
+
+        self.assertEqual(
+            [states[0], states[2], states[6], states[7]],
+            history.downsample(states, 4))
+
+    def test_small_unchanged(self):
+        """ Test lists within max_points are returned as is. """
+        states = self._states(['1', '2', '3'])
+
+        self.assertIs(states, history.downsample(states, 3))
+
+
+class TestRecorderOverflow(unittest.TestCase):
+    """ Test the overflow policies of the recorder queue. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """ Init needed objects. """
+        self.hass = None
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop down stuff we started. """
+        _stop_recorder(self.hass)
+
+    def _fire_test_events(self, count):
+        """ Fire count test events in order before the recorder runs. """
+        for idx in range(count):
+            self.hass.bus.fire('test_event', {'idx': idx})
+            self.hass.pool.block_till_done()
+
+    def _recorded_test_events(self):
+        """ Return the idx of the recorded test events. """
+        return [event.data['idx'] for event in recorder.query_events(
+            "SELECT * FROM events WHERE event_type='test_event' "
+            "ORDER BY event_id")]
+
+    def test_invalid_overflow_policy(self):
+        """ Test setup fails on an unknown overflow policy. """
+        self.hass = _setup_recorder(
+            {recorder.DOMAIN: {recorder.CONF_OVERFLOW: 'explode'}})
+
+        self.assertNotIn(recorder.DOMAIN, self.hass.components)
+
+    def test_drop_oldest(self):
+        """ Test oldest events get dropped when the queue is full. """
+        self.hass = _setup_recorder(
+            {recorder.DOMAIN: {
+                recorder.CONF_QUEUE_SIZE: 2,
+                recorder.CONF_OVERFLOW: recorder.OVERFLOW_DROP_OLDEST}},
+            start=False)
+
+        self._fire_test_events(5)
+
+        self.assertEqual(2, recorder.metrics()['queue_depth'])
+
+        _start_recorder(self.hass)
+
+        # Starting fires an event too that pushes out another test event
+        recorded = self._recorded_test_events()
+
+        self.assertNotIn(0, recorded)
+        self.assertEqual(4, recorded[-1])
+        self.assertLessEqual(3, recorder.metrics()['events_dropped'])
+
+    def test_spill_to_disk(self):
+        """ Test events get spilled to disk and recorded in order. """
+        self.hass = _setup_recorder(
+            {recorder.DOMAIN: {
+                recorder.CONF_QUEUE_SIZE: 1,
+                recorder.CONF_OVERFLOW: recorder.OVERFLOW_SPILL}},
+            start=False)
+
+        self._fire_test_events(5)
+
+        self.assertTrue(os.path.isfile(
+            self.hass.get_config_path(recorder.SPILL_FILE)))
+
+        _start_recorder(self.hass)
+
+        self.assertEqual([0, 1, 2, 3, 4], self._recorded_test_events())
+        self.assertFalse(os.path.isfile(
+            self.hass.get_config_path(recorder.SPILL_FILE)))
+
+        metrics = recorder.metrics()
+
+        self.assertLessEqual(5, metrics['events_spilled'])
+        self.assertFalse(metrics['spilling'])
+
+
+class TestRecorderSegmentBackend(unittest.TestCase):
+    """ Test the segment storage backend. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """ Init needed objects. """
+        self.hass = _setup_recorder(
+            {recorder.DOMAIN: {
+                recorder.CONF_BACKEND: recorder.BACKEND_SEGMENT,
+                recorder.CONF_KEEP_DAYS: 2}})
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop down stuff we started. """
+        _stop_recorder(self.hass)
+
+    def test_read_states(self):
+        """ Test states can be read back, for one or for all entities. """
+        start = datetime.now() - timedelta(seconds=1)
+
+        for idx in range(3):
+            self.hass.states.set('test.one', idx, {'idx': idx})
+            self.hass.states.set('test.two', idx)
+            self.hass.pool.block_till_done()
+
+        recorder._INSTANCE.block_till_done()
+
+        states = list(recorder.read_states(start, entity_id='test.one'))
+
+        self.assertEqual(['0', '1', '2'], [state.state for state in states])
+        self.assertEqual(self.hass.states.get('test.one'), states[-1])
+
+        self.assertEqual(6, len(list(recorder.read_states(start))))
+
+        self.assertEqual(
+            [], list(recorder.read_states(start, start, 'test.one')))
+
+    def test_purge_drops_old_segments(self):
+        """ Test segments older than keep_days get removed on purge. """
+        segment_dir = self.hass.get_config_path(segment.SEGMENT_DIR)
+        old_segment = os.path.join(
+            segment_dir, segment._segment_name(
+                datetime.now() - timedelta(days=3)))
+
+        with open(old_segment, 'w'):
+            pass
+
+        recorder._INSTANCE.backend.purge(2)
+
+        self.assertFalse(os.path.isfile(old_segment))
+        self.assertTrue(os.listdir(segment_dir))
+
+    def test_queries_not_supported(self):
+        """ Test SQL queries are refused by the segment backend. """
+        self.assertFalse(recorder.supports_query())
+
+        with self.assertRaises(ha.HomeAssistantError):
+            recorder.query('SELECT * FROM states')
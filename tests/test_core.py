@@ -249,6 +249,20 @@ class TestStateMachine(unittest.TestCase):
         # If it does not exist, we should get False
         self.assertFalse(self.states.remove('light.Bowl'))
 
+    def test_version(self):
+        """ Test the version increases only when something changed. """
+        version = self.states.version
+
+        self.states.set("light.Bowl", "on")
+        self.assertEqual(version, self.states.version)
+
+        self.states.set("light.Bowl", "on", {'brightness': 100})
+        self.assertEqual(version + 1, self.states.version)
+
+        self.states.remove("light.Bowl")
+        self.states.remove("light.Bowl")
+        self.assertEqual(version + 2, self.states.version)
+
     def test_track_change(self):
         """ Test states.track_change. """
         # 2 lists to track how often our callbacks got called